@@ -0,0 +1,30 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+
+def on_post_migrate(sender, using, **kwargs):
+    from app.role_permissions import backfill_role_memberships, ensure_role_groups
+    from app.search import install_search_indexes
+    install_search_indexes(using)
+    ensure_role_groups(using)
+    backfill_role_memberships(using)
+
+
+def on_connection_created(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+class UserManagementConfig(AppConfig):
+    name = 'app'
+
+    def ready(self):
+        post_migrate.connect(on_post_migrate, sender=self)
+        connection_created.connect(on_connection_created)
+        from app.metrics import install_query_counter
+        connection_created.connect(install_query_counter)
@@ -0,0 +1,39 @@
+from asgiref.sync import sync_to_async
+
+from app import user_utils
+
+
+def _to_async(func):
+    # thread_sensitive=False runs every call on the event loop's executor, so bcrypt hashing and
+    # DB round trips of concurrent callers neither block the loop nor queue behind one another
+    return sync_to_async(func, thread_sensitive=False)
+
+
+aregister_user = _to_async(user_utils.register_user)
+alogin_user = _to_async(user_utils.login_user)
+alogout_user = _to_async(user_utils.logout_user)
+
+aadd_user_permission = _to_async(user_utils.add_user_permission)
+aremove_user_permission = _to_async(user_utils.remove_user_permission)
+abulk_set_permissions = _to_async(user_utils.bulk_set_permissions)
+aget_user_permissions = _to_async(user_utils.get_user_permissions)
+
+atask_list = _to_async(user_utils.task_list)
+atask_detail = _to_async(user_utils.task_detail)
+atask_create = _to_async(user_utils.task_create)
+atask_edit = _to_async(user_utils.task_edit)
+atask_delete = _to_async(user_utils.task_delete)
+atask_bulk_create = _to_async(user_utils.task_bulk_create)
+atask_bulk_edit = _to_async(user_utils.task_bulk_edit)
+atask_bulk_delete = _to_async(user_utils.task_bulk_delete)
+
+anote_list = _to_async(user_utils.note_list)
+anote_detail = _to_async(user_utils.note_detail)
+anote_create = _to_async(user_utils.note_create)
+anote_edit = _to_async(user_utils.note_edit)
+anote_delete = _to_async(user_utils.note_delete)
+anote_bulk_create = _to_async(user_utils.note_bulk_create)
+anote_bulk_edit = _to_async(user_utils.note_bulk_edit)
+anote_bulk_delete = _to_async(user_utils.note_bulk_delete)
+
+asearch = _to_async(user_utils.search)
@@ -0,0 +1,111 @@
+import csv
+import json
+from datetime import datetime, time, timezone as dt_timezone
+
+from django.contrib.auth import get_user_model
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils import timezone
+
+from app.constants import EXPORT_CHUNK_SIZE
+from app.models import UserActionLog
+
+User = get_user_model()
+
+EXPORT_FIELDS = ['id', 'timestamp', 'user_id', 'username', 'action', 'app', 'details']
+
+
+def parse_timestamp(value):
+    if not value:
+        return None
+    timestamp = parse_datetime(value)
+    if timestamp is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(f'Invalid date/time "{value}". Use ISO 8601, e.g. 2023-09-27 or 2023-09-27T21:17:07')
+        timestamp = datetime.combine(date, time.min)
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp, dt_timezone.utc)
+    return timestamp
+
+
+def format_cursor(row):
+    return f'{row["timestamp"].isoformat()},{row["id"]}'
+
+
+def parse_cursor(cursor):
+    timestamp, _, row_id = (cursor or '').strip().rpartition(',')
+    try:
+        timestamp, row_id = parse_timestamp(timestamp), int(row_id)
+    except (TypeError, ValueError):
+        timestamp = None
+    if timestamp is None:
+        raise ValueError(f'Invalid cursor "{cursor}". Expected "<ISO timestamp>,<id>"')
+    return timestamp, row_id
+
+
+def audit_query(user=None, action=None, app=None, since=None, until=None, after=None):
+    """
+    Returns the matching UserActionLog rows ordered by (timestamp, id). Filters map onto
+    the (user, timestamp), (action, timestamp) and timestamp indexes; `after` is a
+    (timestamp, id) cursor returned by format_cursor().
+    """
+    queryset = UserActionLog.objects.all()
+    if user is not None:
+        if not isinstance(user, int):
+            # Resolved up front so the log table is filtered on the indexed user_id column
+            user = User.objects.filter(username=user).values_list('id', flat=True).first() or -1
+        queryset = queryset.filter(user_id=user)
+    if action:
+        queryset = queryset.filter(action=action)
+    if app:
+        queryset = queryset.filter(app=app)
+    if since:
+        queryset = queryset.filter(timestamp__gte=since)
+    if until:
+        queryset = queryset.filter(timestamp__lt=until)
+    if after:
+        timestamp, row_id = after
+        # Written as a range on timestamp so the index can seek straight to the cursor
+        queryset = queryset.filter(timestamp__gte=timestamp).exclude(timestamp=timestamp, id__lte=row_id)
+    return queryset.order_by('timestamp', 'id')
+
+
+def iter_audit_chunks(chunk_size=EXPORT_CHUNK_SIZE, after=None, **filters):
+    # Keyset chunks instead of one long running cursor: memory stays constant on every backend
+    # and each chunk ends on a cursor the export can be resumed from
+    while True:
+        rows = list(audit_query(after=after, **filters).values(
+            'id', 'timestamp', 'user_id', 'user__username', 'action', 'app', 'details')[:chunk_size])
+        if not rows:
+            return
+        for row in rows:
+            row['username'] = row.pop('user__username')
+        yield rows
+        last = rows[-1]
+        after = (last['timestamp'], last['id'])
+
+
+def export_audit_log(stream, file_format='jsonl', write_header=True, chunk_size=EXPORT_CHUNK_SIZE, after=None,
+                     **filters):
+    """
+    Streams matching rows to `stream` as JSONL or CSV, yielding (rows written, cursor)
+    after every chunk so callers can persist the resume point.
+    """
+    writer = None
+    if file_format == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=EXPORT_FIELDS)
+        if write_header:
+            writer.writeheader()
+    elif file_format != 'jsonl':
+        raise ValueError(f'Unsupported export format "{file_format}". Choose from: jsonl, csv')
+
+    written = 0
+    for rows in iter_audit_chunks(chunk_size=chunk_size, after=after, **filters):
+        for row in rows:
+            if writer:
+                writer.writerow(row)
+            else:
+                stream.write(json.dumps(row, default=str) + '\n')
+        stream.flush()
+        written += len(rows)
+        yield written, format_cursor(rows[-1])
@@ -0,0 +1,119 @@
+import hashlib
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from app.models import AuditRollupWatermark, UserActionLog, UserActionRollup
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_NAME = 'user_action_rollup'
+ROLLUP_DIMENSIONS = ['day', 'user', 'action', 'app']
+
+
+def get_rollup_watermark():
+    return AuditRollupWatermark.objects.filter(name=WATERMARK_NAME).values_list('last_id', flat=True).first() or 0
+
+
+def rollup_key(user_id, action, app):
+    return hashlib.sha1(f'{user_id}\0{action}\0{app}'.encode('utf-8')).hexdigest()
+
+
+def _rollup_batch(watermark, start_id, end_id):
+    counts = (UserActionLog.objects.filter(id__gt=start_id, id__lte=end_id)
+              .annotate(day=TruncDate('timestamp'))
+              .values('day', 'user_id', 'action', 'app')
+              .annotate(count=Count('id')))
+    counts = {(row['day'], row['user_id'], row['action'], row['app']): row['count'] for row in counts}
+    total = sum(counts.values())
+
+    if counts:
+        existing = UserActionRollup.objects.filter(day__in={day for day, *_ in counts},
+                                                   action__in={action for _, _, action, _ in counts})
+        to_update = []
+        for rollup in existing:
+            count = counts.pop((rollup.day, rollup.user_id, rollup.action, rollup.app), 0)
+            if count:
+                rollup.count += count
+                to_update.append(rollup)
+        UserActionRollup.objects.bulk_update(to_update, ['count'], batch_size=500)
+
+        # Totals are read and written under the watermark lock; the (day, key) constraint turns
+        # a row that slipped in anyway into an overwrite instead of a second, double-counted row
+        unique_fields = ['day', 'key'] if connection.features.supports_update_conflicts_with_target else None
+        UserActionRollup.objects.bulk_create(
+            [UserActionRollup(day=day, user_id=user_id, action=action, app=app,
+                              key=rollup_key(user_id, action, app), count=count)
+             for (day, user_id, action, app), count in counts.items()],
+            update_conflicts=True, unique_fields=unique_fields, update_fields=['count'], batch_size=500)
+
+    watermark.last_id = end_id
+    watermark.save(update_fields=['last_id', 'updated_at'])
+    return total
+
+
+def refresh_audit_rollups(lag=None, batch_size=None):
+    """
+    Folds UserActionLog rows written since the watermark into UserActionRollup and returns
+    the number of rows processed. Rows younger than `lag` seconds are left for the next run
+    because the audit writer may still be committing rows with lower ids.
+    """
+    lag = getattr(settings, 'AUDIT_ROLLUP_LAG', 30) if lag is None else lag
+    batch_size = batch_size or getattr(settings, 'AUDIT_ROLLUP_BATCH_SIZE', 50000)
+    AuditRollupWatermark.objects.get_or_create(name=WATERMARK_NAME)
+
+    processed, last_id = 0, None
+    while True:
+        # Each batch is its own transaction: the watermark row lock serializes concurrent runs
+        # and the counts and the watermark always move together
+        with transaction.atomic():
+            watermark = AuditRollupWatermark.objects.select_for_update().get(name=WATERMARK_NAME)
+            cutoff = timezone.now() - timedelta(seconds=lag)
+            end_id = UserActionLog.objects.filter(id__gt=watermark.last_id, timestamp__lt=cutoff) \
+                .aggregate(end_id=Max('id'))['end_id']
+            if end_id is None:
+                break
+            start_id = watermark.last_id
+            last_id = min(end_id, start_id + batch_size)
+            processed += _rollup_batch(watermark, start_id, last_id)
+        if last_id == end_id:
+            break
+
+    if last_id is not None:
+        logger.info(f'{processed} audit log rows rolled up to UserActionLog id {last_id}')
+    return processed
+
+
+def rebuild_audit_rollups(**kwargs):
+    with transaction.atomic():
+        UserActionRollup.objects.all().delete()
+        AuditRollupWatermark.objects.update_or_create(name=WATERMARK_NAME, defaults={'last_id': 0})
+    return refresh_audit_rollups(**kwargs)
+
+
+def rollup_report(group_by=('day', 'action'), user=None, action=None, app=None, since=None, until=None):
+    """
+    Returns summed rollup counts grouped by any of ROLLUP_DIMENSIONS. `since` and `until`
+    are dates (inclusive / exclusive); `user` is a username.
+    """
+    unknown = set(group_by) - set(ROLLUP_DIMENSIONS)
+    if unknown:
+        raise ValueError(f'Cannot group by {", ".join(sorted(unknown))}. Choose from: {", ".join(ROLLUP_DIMENSIONS)}')
+    queryset = UserActionRollup.objects.all()
+    if user:
+        queryset = queryset.filter(user__username=user)
+    if action:
+        queryset = queryset.filter(action=action)
+    if app:
+        queryset = queryset.filter(app=app)
+    if since:
+        queryset = queryset.filter(day__gte=since)
+    if until:
+        queryset = queryset.filter(day__lt=until)
+    fields = ['user__username' if field == 'user' else field for field in group_by]
+    return queryset.values(*fields).annotate(total=Sum('count')).order_by(*fields)
@@ -0,0 +1,140 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from app.models import UserActionLog
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLogWriter:
+    """
+    Buffers UserActionLog rows in memory and writes them with bulk_create from a
+    background thread once `batch_size` rows are queued or `flush_interval` seconds
+    have passed. With `asynchronous=False` every row is saved on the caller's path.
+    Counted events are aggregated and written as one row per (action, app, subject)
+    on every flush.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=2.0, asynchronous=True):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.asynchronous = asynchronous
+        self._buffer = []
+        self._counters = {}
+        self._counters_since = timezone.now()
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            batch_size=getattr(settings, 'AUDIT_LOG_BATCH_SIZE', 100),
+            flush_interval=getattr(settings, 'AUDIT_LOG_FLUSH_INTERVAL', 2.0),
+            asynchronous=getattr(settings, 'AUDIT_LOG_ASYNC', True),
+        )
+
+    def write(self, entry):
+        self.write_many([entry])
+
+    def write_many(self, entries):
+        if not entries:
+            return
+        if not self.asynchronous or self._stopped.is_set():
+            UserActionLog.objects.bulk_create(entries, batch_size=self.batch_size)
+            return
+
+        with self._lock:
+            self._buffer.extend(entries)
+            is_full = len(self._buffer) >= self.batch_size
+        self._ensure_started()
+        if is_full:
+            self._wakeup.set()
+
+    def increment(self, action, app, subject):
+        with self._lock:
+            key = (action, app, subject)
+            self._counters[key] = self._counters.get(key, 0) + 1
+        if self.asynchronous and not self._stopped.is_set():
+            self._ensure_started()
+        elif time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _drain_counters(self):
+        now = timezone.now()
+        counters, self._counters = self._counters, {}
+        since, self._counters_since = self._counters_since, now
+        return [UserActionLog(user=None, action=action, app=app, timestamp=now,
+                              details=f'{count} "{action}" events for "{subject}" between {since} and {now}')
+                for (action, app, subject), count in counters.items()]
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                entries, self._buffer = self._buffer, []
+                entries += self._drain_counters()
+                self._last_flush = time.monotonic()
+            if not entries:
+                return 0
+            try:
+                UserActionLog.objects.bulk_create(entries, batch_size=self.batch_size)
+            except Exception as e:
+                logger.error(f'Failed to write {len(entries)} audit log rows: {e}')
+                return 0
+            return len(entries)
+
+    def close(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        return self.flush()
+
+    def _ensure_started(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                self.flush()
+        finally:
+            # The writer thread owns its own DB connection
+            connection.close()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_audit_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = AuditLogWriter.from_settings()
+                atexit.register(_writer.close)
+    return _writer
+
+
+def flush_audit_log():
+    if _writer is None:
+        return 0
+    return _writer.close()
@@ -0,0 +1,226 @@
+import json
+import logging
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import PermissionDenied
+from django.db import DatabaseError, transaction
+
+from app.constants import LIST_PAGE_SIZE
+from app.password_utils import verify_password
+from app.user_utils import RESOURCE_SERVICES, add_user_permission, login_user, logout_user, register_user, \
+    remove_user_permission
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+
+def _check(result):
+    if not result['ok']:
+        raise ValueError(result['error'])
+    return result
+
+
+def _register(runner, user, args):
+    user = register_user(args['username'], args['password'], bool(args.get('is_admin')),
+                         password_hash=args.get('_password_hash'))
+    runner.start_session(user)
+    return {'username': user.username, 'role': user.role}
+
+
+def _login(runner, user, args):
+    user = login_user(args['username'], args['password'], source=runner.source,
+                      password_check=args.get('_password_check'))
+    runner.start_session(user)
+    return {'username': user.username, 'role': user.role}
+
+
+def _logout(runner, user, args):
+    logout_user(user.username, token=getattr(user, 'session_token', None))
+    runner.end_session(user)
+    return {'username': user.username}
+
+
+def _change_permission(change_permission):
+    def handler(runner, user, args):
+        if not user.is_admin:
+            raise PermissionDenied('Only admins can change permissions')
+        error = change_permission(args['resource'], args['username'], args['access'], guarantor=user.username)
+        if isinstance(error, ValueError):
+            raise error
+        return {'username': args['username'], 'resource': args['resource'], 'access': args['access']}
+
+    return handler
+
+
+def _resource_operations(resource, services):
+    id_key = services['id_key']
+
+    def list_objects(runner, user, args):
+        result = services['list'](user, after=args.get('after'), limit=args.get('limit', LIST_PAGE_SIZE))
+        return {'results': [{'id': obj.id, 'title': obj.title} for obj in result['value']],
+                'next_cursor': result['next_cursor']}
+
+    def detail(runner, user, args):
+        return dict(services['detail'](user, args['id'])['value'], id=args['id'])
+
+    def create(runner, user, args):
+        return _check(services['create'](user, [{'title': args['title'], 'content': args.get('content')}])['value'][0])
+
+    def edit(runner, user, args):
+        item = {id_key: args['id'], 'title': args['title'], 'content': args.get('content')}
+        return _check(services['edit'](user, [item])['value'][0])
+
+    def delete(runner, user, args):
+        return _check(services['delete'](user, [args['id']])['value'][0])
+
+    def search(runner, user, args):
+        results = services['search'](user, args['query'], limit=args.get('limit', LIST_PAGE_SIZE))['value']
+        return {'results': [{'id': obj.id, 'title': obj.title, 'rank': obj.rank} for obj in results]}
+
+    def share(runner, user, args):
+        return services['share'](user, args['id'], args['usernames'], can_edit=bool(args.get('can_edit')))['value']
+
+    def unshare(runner, user, args):
+        return services['share'](user, args['id'], args['usernames'], revoke=True)['value']
+
+    return {
+        f'{resource}_list': list_objects,
+        f'{resource}_detail': detail,
+        f'{resource}_create': create,
+        f'{resource}_edit': edit,
+        f'{resource}_delete': delete,
+        f'{resource}_search': search,
+        f'{resource}_share': share,
+        f'{resource}_unshare': unshare,
+    }
+
+
+# Operations that need no logged in user
+SESSION_OPERATIONS = {'register': _register, 'login': _login}
+
+OPERATIONS = dict(
+    SESSION_OPERATIONS,
+    logout=_logout,
+    grant=_change_permission(add_user_permission),
+    revoke=_change_permission(remove_user_permission),
+    **{name: handler for resource, services in RESOURCE_SERVICES.items()
+       for name, handler in _resource_operations(resource, services).items()},
+)
+
+
+class BatchRunner:
+    """
+    Runs JSONL operations such as {"op": "note_create", "title": "..."} through OPERATIONS.
+    Every `batch_size` operations share one transaction and each operation runs in its own
+    savepoint, so a failing operation is rolled back alone. Operations run as the user of
+    the last register/login, or as {"as": "<username>"} of any session opened earlier.
+    Password hashing and checks run before a batch's transaction opens (see prepare).
+    """
+
+    def __init__(self, batch_size=100, stop_on_error=False, source='batch'):
+        self.batch_size = batch_size
+        self.stop_on_error = stop_on_error
+        self.source = source
+        self.sessions = {}
+        self.current = None
+
+    def start_session(self, user):
+        self.sessions[user.username] = user
+        self.current = user
+
+    def end_session(self, user):
+        self.sessions.pop(user.username, None)
+        if self.current is not None and self.current.username == user.username:
+            self.current = None
+
+    def parse(self, lines):
+        for line_no, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                operation = json.loads(line)
+                if not isinstance(operation, dict):
+                    raise ValueError('Each line must be a JSON object')
+            except ValueError as e:
+                operation = {'error': f'Invalid JSON: {e}'}
+            yield line_no, operation
+
+    def prepare(self, batch):
+        """
+        bcrypt work of the batch's register and login operations, done before its transaction
+        opens so the write locks it takes are not held meanwhile. Returns {line_no: extra args}.
+        """
+        prepared = {}
+        for line_no, operation in batch:
+            name, username, password = operation.get('op'), operation.get('username'), operation.get('password')
+            if not isinstance(username, str) or not isinstance(password, str):
+                continue
+            try:
+                if name == 'register':
+                    prepared[line_no] = {'_password_hash': User.generate_password_hash(password).decode('utf-8')}
+                elif name == 'login':
+                    # Only hashes already stored are checked here: a register earlier in the batch may
+                    # still fail, and users it does create are checked by login_user itself
+                    stored = User.objects.filter(username=username).values_list('password', flat=True).first()
+                    if stored:
+                        prepared[line_no] = {'_password_check': (stored, verify_password(password, stored))}
+            except (DatabaseError, ValueError) as e:
+                # Left to the operation itself, which reports the error
+                logger.info(f'Could not prepare line {line_no}: {e}')
+        return prepared
+
+    def execute(self, line_no, operation, prepared=None):
+        name = operation.get('op')
+        response = {'line': line_no, 'op': name}
+        try:
+            if operation.get('error'):
+                raise ValueError(operation['error'])
+            if name not in OPERATIONS:
+                raise ValueError(f'Unknown op "{name}". Choose from: {", ".join(sorted(OPERATIONS))}')
+            user = self.sessions.get(operation['as']) if operation.get('as') else self.current
+            if user is None and name not in SESSION_OPERATIONS:
+                raise PermissionDenied(f'Log in as {operation["as"]} first' if operation.get('as') else 'Log in first')
+            # Underscored arguments only ever come from prepare()
+            args = {key: value for key, value in operation.items() if key not in ['op', 'as'] and key[:1] != '_'}
+            args.update(prepared or {})
+            with transaction.atomic():
+                response['result'] = OPERATIONS[name](self, user, args)
+            response['ok'] = True
+        except KeyError as e:
+            response.update(ok=False, error=f'Missing or unknown argument {e}')
+        except Exception as e:
+            response.update(ok=False, error=str(e) or e.__class__.__name__)
+        return response
+
+    def run(self, lines):
+        """Yields one result per operation, after the transaction holding it has committed."""
+        batch = []
+        for item in self.parse(lines):
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                stopped = yield from self.run_batch(batch)
+                if stopped:
+                    return
+                batch = []
+        if batch:
+            yield from self.run_batch(batch)
+
+    def run_batch(self, batch):
+        results, stopped = [], False
+        prepared = self.prepare(batch)
+        sessions, current = dict(self.sessions), self.current
+        try:
+            with transaction.atomic():
+                for line_no, operation in batch:
+                    results.append(self.execute(line_no, operation, prepared.get(line_no)))
+                    if self.stop_on_error and not results[-1]['ok']:
+                        stopped = True
+                        break
+        except DatabaseError as e:
+            logger.error(f'Batch of {len(batch)} operations rolled back: {e}')
+            results = [dict(result, ok=False, error=f'Batch rolled back: {e}') for result in results]
+            # Sessions opened by the rolled back operations never got a stored token
+            self.sessions, self.current = sessions, current
+            stopped = self.stop_on_error
+        yield from results
+        return stopped
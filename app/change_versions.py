@@ -0,0 +1,26 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def _cache():
+    return caches[getattr(settings, 'CHANGE_VERSION_CACHE_ALIAS', 'default')]
+
+
+def _key(resource):
+    return f'table_version:{resource}'
+
+
+def get_table_version(resource):
+    cache = _cache()
+    version = cache.get(_key(resource))
+    if version is None:
+        # Time based so a lost (evicted) version can never be mistaken for an older one
+        cache.add(_key(resource), time.time_ns(), None)
+        version = cache.get(_key(resource))
+    return version
+
+
+def bump_table_version(resource):
+    _cache().set(_key(resource), time.time_ns(), None)
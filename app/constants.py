@@ -19,6 +19,11 @@ class AccessLevels(models.TextChoices):
     DELETE = "DELETE", "DELETE"
 
 
+class PermissionChangeModes(models.TextChoices):
+    GRANT = "grant", "grant"
+    REVOKE = "revoke", "revoke"
+
+
 class Resources(models.TextChoices):
     TASK = "TASK", "TASK"
     NOTE = "NOTE", "NOTE"
@@ -53,3 +58,13 @@ ROLE_CHOICES = [
 
 RESOURCES = [Resources.NOTE, Resources.TASK]
 
+
+PERMISSION_RESOURCES = ['task', 'note']
+
+PERMISSION_ACCESSES = ['view', 'add', 'change', 'delete']
+
+LIST_PAGE_SIZE = 20
+
+LIST_MAX_PAGE_SIZE = 500
+
+EXPORT_CHUNK_SIZE = 2000
@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+class DetailCache:
+    """
+    Two tier read-through cache for detail payloads: a bounded in-process LRU with a TTL
+    in front of an optional shared Django cache. Entries are stored under
+    `version` so bumping it drops every cached payload at once.
+
+    Every key has a generation in the shared tier, or in the `generation_alias` cache when
+    there is none, replaced on invalidation. Payloads are stored under their generation and
+    local entries remember it, so a load racing with an invalidation never becomes visible
+    and other processes drop their local copy (ACL included) on the next hit: one cache
+    read, no query. Stats are logged every `stats_interval` seconds.
+    """
+
+    def __init__(self, max_entries=10000, ttl=60, shared_alias=None, generation_alias=None, version=1,
+                 stats_interval=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared_alias = shared_alias
+        self.generation_alias = shared_alias or generation_alias
+        self.version = version
+        self.stats_interval = stats_interval
+        self._last_stats = time.monotonic()
+        self._entries = OrderedDict()
+        # Bumped on every invalidation so a load racing with a write never stores the stale payload
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._counters = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_entries=getattr(settings, 'DETAIL_CACHE_MAX_ENTRIES', 10000),
+            ttl=getattr(settings, 'DETAIL_CACHE_TTL', 60),
+            shared_alias=getattr(settings, 'DETAIL_CACHE_SHARED_ALIAS', None),
+            generation_alias=getattr(settings, 'DETAIL_CACHE_GENERATION_ALIAS',
+                                     getattr(settings, 'CHANGE_VERSION_CACHE_ALIAS', 'default')),
+            version=getattr(settings, 'DETAIL_CACHE_VERSION', 1),
+            stats_interval=getattr(settings, 'DETAIL_CACHE_STATS_INTERVAL', 300),
+        )
+
+    @staticmethod
+    def _key(resource, pk):
+        return f'detail:{resource}:{pk}'
+
+    def _shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def _generations(self):
+        return caches[self.generation_alias] if self.generation_alias else None
+
+    def _shared_generation(self, generations, key):
+        generation_key = f'{key}:generation'
+        generation = generations.get(generation_key, version=self.version)
+        if generation is None:
+            # Time based so a lost (evicted) generation can never be mistaken for an older one
+            generations.add(generation_key, time.time_ns(), None, version=self.version)
+            generation = generations.get(generation_key, version=self.version)
+        return generation
+
+    def _store_local(self, key, shared_generation, payload):
+        self._entries[key] = (time.monotonic() + self.ttl, shared_generation, payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def get_or_load(self, resource, pk, loader):
+        key = self._key(resource, pk)
+        shared, generations = self._shared(), self._generations()
+        # Read before loading: a payload loaded from before an invalidation is stored under the old one
+        shared_generation = self._shared_generation(generations, key) if generations else None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic() and entry[1] == shared_generation:
+                self._entries.move_to_end(key)
+                self._counters['local_hits'] += 1
+                payload = entry[2]
+            else:
+                self._entries.pop(key, None)
+                payload, generation = None, self._generation
+        if payload is not None:
+            self._log_stats_when_due()
+            return payload
+
+        shared_key = f'{key}:{shared_generation}'
+        payload = shared.get(shared_key, version=self.version) if shared else None
+        if payload is not None:
+            counter = 'shared_hits'
+        else:
+            counter = 'misses'
+            payload = loader()
+            if shared:
+                shared.add(shared_key, payload, self.ttl, version=self.version)
+
+        with self._lock:
+            self._counters[counter] += 1
+            if self._generation == generation:
+                self._store_local(key, shared_generation, payload)
+        self._log_stats_when_due()
+        return payload
+
+    def invalidate(self, resource, *pks):
+        keys = [self._key(resource, pk) for pk in pks]
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+            self._generation += 1
+            self._counters['invalidations'] += len(keys)
+        generations = self._generations()
+        if generations:
+            # Payloads under the old generations are never read again and expire with their TTL
+            generations.set_many({f'{key}:generation': time.time_ns() for key in keys}, None, version=self.version)
+
+    def _log_stats_when_due(self):
+        # Long running servers never reach log_detail_cache_stats() at exit
+        with self._lock:
+            due = time.monotonic() - self._last_stats >= self.stats_interval
+            if due:
+                self._last_stats = time.monotonic()
+        if due:
+            logger.info(f'Detail cache stats: {self.stats()}')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, size=len(self._entries), max_entries=self.max_entries)
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_ratio'] = round((stats['local_hits'] + stats['shared_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+_detail_cache = None
+_detail_cache_lock = threading.Lock()
+
+
+def get_detail_cache():
+    global _detail_cache
+    if _detail_cache is None:
+        with _detail_cache_lock:
+            if _detail_cache is None:
+                _detail_cache = DetailCache.from_settings()
+    return _detail_cache
+
+
+def log_detail_cache_stats():
+    if _detail_cache is not None:
+        logger.info(f'Detail cache stats: {_detail_cache.stats()}')
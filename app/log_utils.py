@@ -0,0 +1,138 @@
+import atexit
+import copy
+import gzip
+import json
+import logging
+import logging.config
+import logging.handlers
+import os
+import queue
+import shutil
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and is kept in JSON records
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the record's metadata and any `extra=` fields."""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'thread': record.threadName,
+            'process': record.process,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = self.formatStack(record.stack_info)
+        data.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES})
+        return json.dumps(data, default=str)
+
+
+def _gzip_namer(name):
+    return f'{name}.gz'
+
+
+def _gzip_rotator(source, dest):
+    with open(source, 'rb') as source_file, gzip.open(dest, 'wb') as dest_file:
+        shutil.copyfileobj(source_file, dest_file)
+    os.remove(source)
+
+
+class CompressedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler that gzips every rotated file."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.namer = _gzip_namer
+        self.rotator = _gzip_rotator
+
+
+class CompressedTimedRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """TimedRotatingFileHandler that gzips every rotated file."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.namer = _gzip_namer
+        self.rotator = _gzip_rotator
+
+
+def build_handler(spec):
+    """
+    Builds a handler from a dictConfig-like dict: 'class', optional 'level' and 'formatter'
+    (logging.Formatter kwargs, or a '()' factory path plus its kwargs), the rest goes to the class.
+    """
+    spec = dict(spec)
+    resolve = logging.config.BaseConfigurator({}).resolve
+    handler_class = spec.pop('class')
+    level = spec.pop('level', logging.NOTSET)
+    formatter = dict(spec.pop('formatter', None) or {})
+    handler = (resolve(handler_class) if isinstance(handler_class, str) else handler_class)(**spec)
+    handler.setLevel(level)
+    factory = formatter.pop('()', logging.Formatter)
+    handler.setFormatter((resolve(factory) if isinstance(factory, str) else factory)(**formatter))
+    return handler
+
+
+class QueueListenerHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on an in-memory queue and lets a QueueListener thread hand them to the
+    `targets` handlers, so formatting, file writes and rotation never block the logging
+    thread. Targets are handler specs (see build_handler) and are built here so this handler
+    owns them: handlers that no logger references would be garbage collected by dictConfig.
+    The listener thread starts on first use, i.e. in the process that logs.
+    """
+
+    def __init__(self, targets=(), respect_handler_level=True):
+        super().__init__(queue.SimpleQueue())
+        self.listener = None
+        self._closed = False
+        self.respect_handler_level = respect_handler_level
+        self.targets = [build_handler(spec) for spec in targets]
+
+    def _start_listener(self):
+        self.listener = logging.handlers.QueueListener(
+            self.queue, *self.targets, respect_handler_level=self.respect_handler_level)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def prepare(self, record):
+        # Only the message is rendered on the caller's thread; the targets do the formatting
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        if self.listener is None and not self._closed:
+            self.acquire()
+            try:
+                if self.listener is None:
+                    self._start_listener()
+            except Exception:
+                self.handleError(record)
+                return
+            finally:
+                self.release()
+        super().emit(record)
+
+    def close(self):
+        # Drains the queue into the targets, which only this handler knows about, then closes them
+        self._closed = True
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        for target in self.targets:
+            target.close()
+        super().close()
@@ -0,0 +1,70 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class LoginThrottled(ValueError):
+    pass
+
+
+def _cache():
+    return caches[getattr(settings, 'LOGIN_THROTTLE_CACHE_ALIAS', 'default')]
+
+
+def _window():
+    return getattr(settings, 'LOGIN_THROTTLE_WINDOW', 300)
+
+
+def _identities(username, source):
+    identities = [('username', username, getattr(settings, 'LOGIN_THROTTLE_USERNAME_LIMIT', 5))]
+    if source:
+        identities.append(('source', source, getattr(settings, 'LOGIN_THROTTLE_SOURCE_LIMIT', 20)))
+    return identities
+
+
+def _key(scope, identity, window_index):
+    # Hashed so any username is a valid key for memcached-like backends
+    digest = hashlib.sha1(str(identity).encode('utf-8')).hexdigest()
+    return f'login_failures:{scope}:{digest}:{window_index}'
+
+
+def is_login_throttled(username, source=None):
+    """
+    Sliding window counter: failures of the previous window count proportionally to
+    how much of it still overlaps the last `LOGIN_THROTTLE_WINDOW` seconds.
+    """
+    window = _window()
+    now = time.time()
+    window_index = int(now // window)
+    overlap = 1 - (now % window) / window
+    identities = _identities(username, source)
+    keys = [_key(scope, identity, index) for scope, identity, _ in identities
+            for index in (window_index, window_index - 1)]
+    counts = _cache().get_many(keys)
+    for scope, identity, limit in identities:
+        current = counts.get(_key(scope, identity, window_index), 0)
+        previous = counts.get(_key(scope, identity, window_index - 1), 0)
+        if current + previous * overlap >= limit:
+            return True
+    return False
+
+
+def record_login_failure(username, source=None):
+    cache = _cache()
+    window = _window()
+    window_index = int(time.time() // window)
+    for scope, identity, _ in _identities(username, source):
+        key = _key(scope, identity, window_index)
+        cache.add(key, 0, 2 * window)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            cache.set(key, 1, 2 * window)
+
+
+def reset_login_failures(username):
+    window_index = int(time.time() // _window())
+    _cache().delete_many([_key('username', username, index) for index in (window_index, window_index - 1)])
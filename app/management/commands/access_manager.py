@@ -1,24 +1,53 @@
+import json
+import sys
+import time
+
+# Taken before the command's imports so --profile-startup can report their cost. The service layer
+# is imported by the handlers that use it, so --fast-start reaches the menu without loading it
+_import_started_at = time.perf_counter()
+
 from django.core.exceptions import PermissionDenied, ValidationError
 from django.core.management.base import BaseCommand
 from django.core.management import call_command
 
-from app.user_utils import login_user, note_list, task_list, note_create, note_detail, note_edit, \
-    note_delete, task_detail, task_create, task_edit, task_delete, add_user_permission, create_db, get_user_permissions, \
-    remove_user_permission, logout_user
-
 from app.management.constants import REGISTER_USER_OPTION, HOME_PAGE, LOGGED_IN_PAGE, EXIT_USER_OPTION, NOTES_PAGE, \
     TASKS_PAGE, TASKS, NOTES, LOGIN_USER_OPTION, NOTE_DETAIL, CREATE_NOTE, UPDATE_NOTE, DELETE_NOTE, TASK_DETAIL, \
     CREATE_TASK, UPDATE_TASK, DELETE_TASK, ADMIN_PANEL_OPTION, ADMIN_PAGE, VIEW_ACCESS, UPDATE_ACCESS, ADD_ACCESS, \
-    DELETE_ACCESS, HOME_PAGE_OPTION, LOGOUT_USER_OPTION
+    DELETE_ACCESS, HOME_PAGE_OPTION, LOGOUT_USER_OPTION, NEXT_PAGE_OPTION, SEARCH_NOTES, SEARCH_TASKS
+
+_imported_at = time.perf_counter()
 
 
 class Command(BaseCommand):
     help = 'User management program from the command line'
     user = None
+    # Where logins come from, used for per-source login throttling
+    source = None
     min_length = 8
     min_digit_count = 1
     min_special_char_count = 1
 
+    def add_arguments(self, parser):
+        parser.add_argument('--serve', action='store_true',
+                            help='Serve concurrent menu sessions over a TCP or Unix socket instead of this terminal')
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--socket', help='Unix socket path to listen on instead of --host/--port')
+        parser.add_argument('--max-sessions', type=int, default=256,
+                            help='Sessions open at once (one thread each); further connections are turned away')
+        parser.add_argument('--script', help='Run the operations of a JSONL file ("-" for stdin) instead of the '
+                                             'interactive menu')
+        parser.add_argument('--batch-size', type=int, default=100, help='Script operations per transaction')
+        parser.add_argument('--results', help='Write script results as JSONL to this file instead of stdout')
+        parser.add_argument('--stop-on-error', action='store_true', help='Stop the script at the first failed operation')
+        parser.add_argument('--fast-start', action='store_true',
+                            help='Skip create_db, makemigrations and migrate when the schema is unchanged since the '
+                                 'last run')
+        parser.add_argument('--profile-startup', action='store_true', help='Report where startup time goes')
+
+    def prompt(self, text):
+        return input(text)
+
     def validate(self, password):
         if len(password) < self.min_length:
             raise ValidationError(
@@ -41,9 +70,9 @@ class Command(BaseCommand):
             )
 
     def register(self):
-        username = input('Enter a username: ')
-        password = input('Enter a password: ')
-        is_admin = input('Is admin[y/n] (Optional): ')
+        username = self.prompt('Enter a username: ')
+        password = self.prompt('Enter a password: ')
+        is_admin = self.prompt('Is admin[y/n] (Optional): ')
 
         self.validate(password)
         if is_admin and is_admin in ['y', 'Y']:
@@ -63,11 +92,12 @@ class Command(BaseCommand):
         return None
 
     def login(self):
-        username = input('Enter a username: ')
-        password = input('Enter a password: ')
+        username = self.prompt('Enter a username: ')
+        password = self.prompt('Enter a password: ')
 
         try:
-            user = login_user(username, password)
+            from app.user_utils import login_user
+            user = login_user(username, password, source=self.source)
             self.stdout.write(self.style.SUCCESS(f'User "{username}" successfully logged in.'))
             return user
         except ValueError as e:
@@ -78,7 +108,8 @@ class Command(BaseCommand):
 
     def logout(self):
         try:
-            logout_user(self.user)
+            from app.user_utils import logout_user
+            logout_user(self.user.username, token=getattr(self.user, 'session_token', None))
             self.stdout.write(self.style.SUCCESS("Logged out successfully!"))
             self.user = None
         except ValueError as e:
@@ -111,7 +142,10 @@ class Command(BaseCommand):
         elif page == NOTES_PAGE:
             self.show_app_permissions(self.user, 'note')
             self.show_notes()
+            if self.next_cursors.get(NOTES_PAGE):
+                self.stdout.write(f"{NEXT_PAGE_OPTION}. Next Page")
             self.stdout.write(f"{NOTE_DETAIL}. Show Note Detail")
+            self.stdout.write(f"{SEARCH_NOTES}. Search Notes")
             self.stdout.write(f"{CREATE_NOTE}. Create Note")
             self.stdout.write(f"{UPDATE_NOTE}. Update Note")
             self.stdout.write(f"{DELETE_NOTE}. Delete Note")
@@ -119,7 +153,10 @@ class Command(BaseCommand):
         elif page == TASKS_PAGE:
             self.show_app_permissions(self.user, 'task')
             self.show_tasks()
+            if self.next_cursors.get(TASKS_PAGE):
+                self.stdout.write(f"{NEXT_PAGE_OPTION}. Next Page")
             self.stdout.write(f"{TASK_DETAIL}. Show Task Detail")
+            self.stdout.write(f"{SEARCH_TASKS}. Search Tasks")
             self.stdout.write(f"{CREATE_TASK}. Create Task")
             self.stdout.write(f"{UPDATE_TASK}. Update Task")
             self.stdout.write(f"{DELETE_TASK}. Delete Task")
@@ -130,39 +167,112 @@ class Command(BaseCommand):
         self.stdout.write(f"{EXIT_USER_OPTION}. Exit")
 
     def show_app_permissions(self, user, resource):
+        from app.user_utils import get_user_permissions
         all_perms = ",".join(get_user_permissions(user, resource))
-        print('USER PERMISSIONS:', all_perms)
+        self.stdout.write(f'USER PERMISSIONS: {all_perms}')
 
     def show_notes(self):
-        notes = note_list(self.user)['value']
-        for note in notes:
-            print(note)
+        from app.user_utils import note_list
+        result = note_list(self.user, after=self.page_cursors.get(NOTES_PAGE))
+        for note in result['value']:
+            self.stdout.write(str(note))
+        self.next_cursors[NOTES_PAGE] = result['next_cursor']
 
     def show_tasks(self):
-        tasks = task_list(self.user)['value']
-        for task in tasks:
-            print(task)
+        from app.user_utils import task_list
+        result = task_list(self.user, after=self.page_cursors.get(TASKS_PAGE))
+        for task in result['value']:
+            self.stdout.write(str(task))
+        self.next_cursors[TASKS_PAGE] = result['next_cursor']
+
+    def timed(self, label, func):
+        started_at = time.perf_counter()
+        try:
+            return func()
+        finally:
+            self.startup_timings.append((label, time.perf_counter() - started_at))
+
+    def report_startup(self):
+        # manage.py records when it started; other entry points only get the phases below
+        process_started_at = getattr(sys.modules['__main__'], 'STARTED_AT', None)
+        timings = [('command import', _imported_at - _import_started_at)] + self.startup_timings
+        if process_started_at is not None:
+            timings.insert(0, ('Django setup', _import_started_at - process_started_at))
+        self.stdout.write('Startup profile:')
+        for label, seconds in timings:
+            self.stdout.write(f'  {label:<30}{seconds * 1000:>9.1f} ms')
+        self.stdout.write(f'  {"total":<30}{sum(seconds for _, seconds in timings) * 1000:>9.1f} ms')
+
+    def prepare_database(self, fast_start):
+        from app.schema_state import record_schema_state, schema_is_current
+        if fast_start and self.timed('schema check', schema_is_current):
+            return True
+        from app.user_utils import create_db
+        if not self.timed('create_db', create_db):
+            return False
+        self.timed('makemigrations', lambda: call_command('makemigrations', 'app'))
+        self.timed('migrate', lambda: call_command('migrate', 'app'))
+        self.timed('record schema state', record_schema_state)
+        return True
 
     def handle(self, *args, **options):
-        status = create_db()
+        self.startup_timings = []
+        status = self.prepare_database(options['fast_start'])
         if status:
-            call_command('makemigrations', 'app')
-            call_command('migrate', 'app')
-
             if options.get('import'):
                 call_command('importDb')
-            self.execute_manager()
+            if options['profile_startup']:
+                self.report_startup()
+            try:
+                if options['script']:
+                    self.run_script(options)
+                elif options.get('serve'):
+                    from app.session_server import SessionServer
+                    SessionServer(host=options['host'], port=options['port'], socket_path=options['socket'],
+                                  max_sessions=options['max_sessions']).run()
+                else:
+                    self.execute_manager()
+            finally:
+                from app.audit_writer import flush_audit_log
+                from app.detail_cache import log_detail_cache_stats
+                flush_audit_log()
+                log_detail_cache_stats()
         else:
-            print('DB Creation failed!')
+            self.stdout.write('DB Creation failed!')
+
+    def run_script(self, options):
+        from app.batch_runner import BatchRunner
+        runner = BatchRunner(batch_size=max(1, options['batch_size']), stop_on_error=options['stop_on_error'])
+        script = sys.stdin if options['script'] == '-' else open(options['script'])
+        results = open(options['results'], 'w') if options['results'] else self.stdout
+        succeeded = failed = 0
+        started_at = time.perf_counter()
+        try:
+            for result in runner.run(script):
+                results.write(json.dumps(result, default=str) + '\n')
+                if result['ok']:
+                    succeeded += 1
+                else:
+                    failed += 1
+        finally:
+            if script is not sys.stdin:
+                script.close()
+            if options['results']:
+                results.close()
+        elapsed = time.perf_counter() - started_at
+        self.stderr.write(f'{succeeded} operations succeeded, {failed} failed in {elapsed:.2f}s '
+                          f'({(succeeded + failed) / max(elapsed, 1e-6):.0f} ops/s)')
 
     def execute_manager(self):
         page = HOME_PAGE
+        # List cursor of the page being shown and of the page after it, per listing page
+        self.page_cursors, self.next_cursors = {}, {}
         self.intro()
 
         while True:
             try:
                 self.show_options(page)
-                option = input('Choose an OPTION: ')
+                option = self.prompt('Choose an OPTION: ')
 
                 if option == EXIT_USER_OPTION:
                     break
@@ -170,6 +280,9 @@ class Command(BaseCommand):
                     page = HOME_PAGE
                     continue
                 page = self.navigate_from_options(page, option)
+            except EOFError:
+                # Input closed (Ctrl-D or a disconnected session)
+                break
             except PermissionDenied as e:
                 self.stdout.write(self.style.ERROR(str(e)))
             except Exception as e:
@@ -178,6 +291,8 @@ class Command(BaseCommand):
                 self.stdout.write("")
 
     def navigate_from_options(self, page, option):
+        from app.user_utils import add_user_permission, note_create, note_delete, note_detail, note_edit, \
+            remove_user_permission, search, task_create, task_delete, task_detail, task_edit
         if option == REGISTER_USER_OPTION:
             page = self.execute_register(page)
         if option == LOGIN_USER_OPTION:
@@ -189,48 +304,62 @@ class Command(BaseCommand):
             page = ADMIN_PAGE
         if option == NOTES:
             page = NOTES_PAGE
+            self.page_cursors[page] = None
         if option == TASKS:
             page = TASKS_PAGE
+            self.page_cursors[page] = None
+        if option == NEXT_PAGE_OPTION:
+            self.page_cursors[page] = self.next_cursors.get(page)
         if option == NOTE_DETAIL:
-            note_id = input('Enter Note ID: ')
+            note_id = self.prompt('Enter Note ID: ')
             detail = note_detail(self.user, note_id)
-            print(f"Your requested note details are: Title: {detail['value']['title']} Content: "
-                  f"{detail['value']['content']}")
+            self.stdout.write(f"Your requested note details are: Title: {detail['value']['title']} Content: "
+                              f"{detail['value']['content']}")
+            page = NOTES_PAGE
+        if option == SEARCH_NOTES:
+            query = self.prompt('Enter search text: ')
+            for note in search(self.user, 'note', query)['value']:
+                self.stdout.write(str(note))
             page = NOTES_PAGE
         if option == CREATE_NOTE:
-            title = input('Enter Title: ')
-            content = input('Enter Content: ')
+            title = self.prompt('Enter Title: ')
+            content = self.prompt('Enter Content: ')
             note_create(self.user, {'title': title, 'content': content})
             page = NOTES_PAGE
         if option == UPDATE_NOTE:
-            note_id = input('Enter Note ID: ')
-            title = input('Enter New Title: ')
-            content = input('Enter New Content: ')
+            note_id = self.prompt('Enter Note ID: ')
+            title = self.prompt('Enter New Title: ')
+            content = self.prompt('Enter New Content: ')
             note_edit(self.user, {'note_id': note_id, 'title': title, 'content': content})
             page = NOTES_PAGE
         if option == DELETE_NOTE:
-            note_id = input('Enter Note ID: ')
+            note_id = self.prompt('Enter Note ID: ')
             note_delete(self.user, note_id)
             page = NOTES_PAGE
         if option == TASK_DETAIL:
-            task_id = input('Enter Task ID: ')
+            task_id = self.prompt('Enter Task ID: ')
             detail = task_detail(self.user, task_id)
-            print(f"Your requested task details are: Title: {detail['value']['title']} Content: "
-                  f"{detail['value']['content']}")
+            self.stdout.write(f"Your requested task details are: Title: {detail['value']['title']} Content: "
+                              f"{detail['value']['content']}")
+            page = TASKS_PAGE
+        if option == SEARCH_TASKS:
+            query = self.prompt('Enter search text: ')
+            for task in search(self.user, 'task', query)['value']:
+                self.stdout.write(str(task))
             page = TASKS_PAGE
         if option == CREATE_TASK:
-            title = input('Enter Title: ')
-            content = input('Enter Content: ')
+            title = self.prompt('Enter Title: ')
+            content = self.prompt('Enter Content: ')
             task_create(self.user, {'title': title, 'content': content})
             page = TASKS_PAGE
         if option == UPDATE_TASK:
-            task_id = input('Enter Task ID: ')
-            title = input('Enter New Title: ')
-            content = input('Enter New Content: ')
+            task_id = self.prompt('Enter Task ID: ')
+            title = self.prompt('Enter New Title: ')
+            content = self.prompt('Enter New Content: ')
             task_edit(self.user, {'task_id': task_id, 'title': title, 'content': content})
             page = TASKS_PAGE
         if option == DELETE_TASK:
-            task_id = input('Enter Task ID: ')
+            task_id = self.prompt('Enter Task ID: ')
             task_delete(self.user, task_id)
             page = TASKS_PAGE
         if option == VIEW_ACCESS:
@@ -275,16 +404,15 @@ class Command(BaseCommand):
             page = ADMIN_PAGE
         return page
 
-    @staticmethod
-    def get_details_for_access():
+    def get_details_for_access(self):
         resource, uid, option = None, None, None
         resources = ['note', 'task']
         options = ['add', 'delete']
         while resource not in resources:
-            print(f'Please chose from: {", ".join(resources)}')
-            resource = input('Enter Resource Name: ')
-        uid = input('Enter username to add: ')
-        option = input(f'Choose access option - {", ".join(options)}: ')
+            self.stdout.write(f'Please chose from: {", ".join(resources)}')
+            resource = self.prompt('Enter Resource Name: ')
+        uid = self.prompt('Enter username to add: ')
+        option = self.prompt(f'Choose access option - {", ".join(options)}: ')
         return resource, uid, option
 
     def execute_register(self, page):
@@ -293,7 +421,7 @@ class Command(BaseCommand):
             self.user = user
             return LOGGED_IN_PAGE
         else:
-            print('Failed! Try again!')
+            self.stdout.write('Failed! Try again!')
         return page
 
     def execute_login(self, page):
@@ -302,5 +430,5 @@ class Command(BaseCommand):
             self.user = user
             page = LOGGED_IN_PAGE
         else:
-            print("Invalid Login!")
+            self.stdout.write("Invalid Login!")
         return page
@@ -0,0 +1,58 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from app.metrics import LATENCY_BUCKETS, format_prometheus, get_metrics_dir, load_metrics, reset_metrics
+
+
+def estimate_quantile(stats, quantile):
+    # Upper bound of the histogram bucket holding the quantile, like Prometheus' histogram_quantile
+    rank = stats['calls'] * quantile
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS, stats['buckets']):
+        cumulative += count
+        if cumulative >= rank:
+            return bound
+    return float('inf')
+
+
+class Command(BaseCommand):
+    help = 'Show call counts, latency, SQL query counts and DB time of the user_utils service operations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['table', 'prometheus', 'json'], default='table')
+        parser.add_argument('--output', help='Write to this file instead of stdout, e.g. for a node_exporter '
+                                             'textfile collector')
+        parser.add_argument('--metrics-dir', default=get_metrics_dir())
+        parser.add_argument('--reset', action='store_true', help='Delete the collected snapshots afterwards')
+
+    def handle(self, *args, **options):
+        operations, processes = load_metrics(options['metrics_dir'])
+        if options['format'] == 'prometheus':
+            text = format_prometheus(operations)
+        elif options['format'] == 'json':
+            text = json.dumps(operations, indent=2, sort_keys=True) + '\n'
+        else:
+            text = self.format_table(operations, processes)
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(text)
+        else:
+            self.stdout.write(text, ending='')
+
+        if options['reset']:
+            reset_metrics(options['metrics_dir'])
+
+    @staticmethod
+    def format_table(operations, processes):
+        lines = [f'{len(operations)} operations from {processes} process snapshots',
+                 f'{"operation":<24}{"calls":>9}{"errors":>8}{"avg ms":>9}{"p50 ms":>9}{"p95 ms":>9}'
+                 f'{"q/call":>8}{"db ms/call":>12}']
+        for operation, stats in sorted(operations.items(), key=lambda item: -item[1]['seconds']):
+            calls = max(stats['calls'], 1)
+            lines.append(f'{operation:<24}{stats["calls"]:>9}{stats["errors"]:>8}'
+                         f'{stats["seconds"] * 1000 / calls:>9.2f}'
+                         f'{estimate_quantile(stats, 0.5) * 1000:>9.1f}{estimate_quantile(stats, 0.95) * 1000:>9.1f}'
+                         f'{stats["queries"] / calls:>8.1f}{stats["db_seconds"] * 1000 / calls:>12.2f}')
+        return '\n'.join(lines) + '\n'
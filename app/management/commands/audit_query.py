@@ -0,0 +1,92 @@
+import json
+import os
+import sys
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from app.audit_query import export_audit_log, parse_cursor, parse_timestamp
+from app.constants import EXPORT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Query UserActionLog rows and stream them as JSONL or CSV. Interrupted exports can be resumed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username')
+        parser.add_argument('--action')
+        parser.add_argument('--app')
+        parser.add_argument('--since', help='ISO 8601 date/time (inclusive)')
+        parser.add_argument('--until', help='ISO 8601 date/time (exclusive)')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl')
+        parser.add_argument('--output', help='File to write to. Defaults to stdout.')
+        parser.add_argument('--after', help='Cursor "<ISO timestamp>,<id>" to start after')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue an interrupted export from the cursor saved next to --output')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+        parser.add_argument('--lag', type=float, default=getattr(settings, 'AUDIT_EXPORT_LAG', 30),
+                            help='Leave out rows younger than this many seconds; the audit writer may still be '
+                                 'inserting rows with older timestamps')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        cursor_path = f'{output}.cursor' if output else None
+        try:
+            filters = {
+                'user': options['user'],
+                'action': options['action'],
+                'app': options['app'],
+                'since': parse_timestamp(options['since']),
+                'until': parse_timestamp(options['until']),
+            }
+            cutoff = timezone.now() - timedelta(seconds=max(0, options['lag']))
+            if filters['until'] is None or filters['until'] > cutoff:
+                filters['until'] = cutoff
+            cursor, offset = options['after'], None
+            if options['resume']:
+                if not cursor_path:
+                    raise CommandError('--resume needs --output')
+                if os.path.exists(cursor_path):
+                    cursor, offset = self.load_cursor(cursor_path)
+            after = parse_cursor(cursor) if cursor else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        appending = bool(after) and output and os.path.exists(output)
+        if appending and offset is not None:
+            # Drops whatever an interrupted run wrote after the last completed chunk
+            os.truncate(output, offset)
+        stream = open(output, 'a' if appending else 'w', newline='') if output else sys.stdout
+        written, last_cursor = 0, cursor
+        try:
+            for written, last_cursor in export_audit_log(stream, options['format'], write_header=not appending,
+                                                         chunk_size=options['chunk_size'], after=after, **filters):
+                if cursor_path:
+                    # The chunk is on disk before the cursor pointing past it is saved
+                    os.fsync(stream.fileno())
+                    self.save_cursor(cursor_path, last_cursor, os.fstat(stream.fileno()).st_size)
+        except KeyboardInterrupt:
+            self.stderr.write(f'Interrupted after {written} rows. Resume with --after "{last_cursor}"'
+                              f'{" or --resume" if cursor_path else ""}.')
+            return
+        finally:
+            if output:
+                stream.close()
+
+        self.stderr.write(self.style.SUCCESS(f'Exported {written} rows. Last cursor: {last_cursor}'))
+
+    @staticmethod
+    def load_cursor(path):
+        with open(path) as cursor_file:
+            state = json.load(cursor_file)
+        return state['cursor'], state['offset']
+
+    @staticmethod
+    def save_cursor(path, cursor, offset):
+        # Cursor and output size are replaced together, so they always describe the same chunk
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as cursor_file:
+            json.dump({'cursor': cursor, 'offset': offset}, cursor_file)
+        os.replace(tmp_path, path)
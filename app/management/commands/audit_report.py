@@ -0,0 +1,42 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.audit_query import parse_timestamp
+from app.audit_rollup import ROLLUP_DIMENSIONS, refresh_audit_rollups, rollup_report
+
+
+class Command(BaseCommand):
+    help = 'Report audit event counts from the daily rollups, e.g. logins per user per day'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--group-by', nargs='+', choices=ROLLUP_DIMENSIONS, default=['day', 'action'])
+        parser.add_argument('--user', help='Username')
+        parser.add_argument('--action')
+        parser.add_argument('--app')
+        parser.add_argument('--since', help='ISO 8601 date (inclusive)')
+        parser.add_argument('--until', help='ISO 8601 date (exclusive)')
+        parser.add_argument('--format', choices=['table', 'csv'], default='table')
+        parser.add_argument('--refresh', action='store_true', help='Roll up new audit log rows first')
+
+    def handle(self, *args, **options):
+        try:
+            since, until = parse_timestamp(options['since']), parse_timestamp(options['until'])
+            if options['refresh']:
+                refresh_audit_rollups()
+            rows = rollup_report(group_by=options['group_by'], user=options['user'], action=options['action'],
+                                 app=options['app'], since=since and since.date(), until=until and until.date())
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        header = options['group_by'] + ['count']
+        lines = [[str(value) for value in row.values()] for row in rows]
+        if options['format'] == 'csv':
+            writer = csv.writer(self.stdout, lineterminator='\n')
+            writer.writerow(header)
+            writer.writerows(lines)
+            return
+
+        widths = [max([len(header[i])] + [len(line[i]) for line in lines]) for i in range(len(header))]
+        for line in [header] + lines:
+            self.stdout.write('  '.join(value.ljust(width) for value, width in zip(line, widths)))
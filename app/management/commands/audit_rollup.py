@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.audit_rollup import rebuild_audit_rollups, refresh_audit_rollups
+
+
+class Command(BaseCommand):
+    help = 'Fold UserActionLog rows written since the last run into the daily UserActionRollup counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lag', type=int, default=getattr(settings, 'AUDIT_ROLLUP_LAG', 30),
+                            help='Skip rows younger than this many seconds')
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'AUDIT_ROLLUP_BATCH_SIZE', 50000))
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recount everything from the raw log. Counts of already purged rows are lost.')
+
+    def handle(self, *args, **options):
+        if options['lag'] < 0 or options['batch_size'] < 1:
+            raise CommandError('--lag must be >= 0 and --batch-size >= 1')
+        refresh = rebuild_audit_rollups if options['rebuild'] else refresh_audit_rollups
+        processed = refresh(lag=options['lag'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {processed} audit log rows.'))
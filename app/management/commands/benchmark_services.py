@@ -0,0 +1,236 @@
+import json
+import os
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from app.audit_writer import flush_audit_log
+from app.constants import PermissionChangeModes, RoleChoices
+from app.models import Note, Task, TaskShare, UserActionLog
+from app.password_utils import hash_password
+from app.role_permissions import join_role_groups
+from app.user_utils import BULK_CHUNK_SIZE, add_user_permission, authenticate_token, bulk_set_permissions, \
+    get_user_permissions, login_user, logout_user, note_list, register_user, remove_user_permission, \
+    task_bulk_create, task_create, task_delete, task_detail, task_edit, task_list, task_search
+
+User = get_user_model()
+
+BENCH_PASSWORD = 'bench-Passw0rd'
+
+# Maximum SQL queries a single warm call may run. Audit rows are written synchronously during
+# a run but not counted. Lower a budget when an optimization lands so it cannot silently regress.
+QUERY_BUDGETS = {
+    'register_user': 6,
+    'login_user': 2,
+    'logout_user': 3,
+    'authenticate_token': 0,
+    'get_user_permissions': 0,
+    'add_user_permission': 9,
+    'remove_user_permission': 10,
+    'bulk_set_permissions': 8,
+    'task_list': 1,
+    'task_list_deep_page': 1,
+    'task_list_member': 3,
+    'note_list': 1,
+    'task_detail': 0,
+    'task_search': 1,
+    'task_create': 1,
+    'task_edit': 2,
+    'task_delete': 5,
+    'task_bulk_create': 3,
+}
+
+
+def count_service_queries(queries):
+    """Query count without the audit rows, including the BEGIN/COMMIT of an autocommit audit write."""
+    audit_insert = f'INSERT INTO {connection.ops.quote_name(UserActionLog._meta.db_table)}'
+    sql = [query['sql'] for query in queries]
+    skipped = set()
+    for i, statement in enumerate(sql):
+        if statement.startswith(audit_insert):
+            skipped.add(i)
+            if 0 < i < len(sql) - 1 and sql[i - 1] == 'BEGIN' and sql[i + 1] == 'COMMIT':
+                skipped.update([i - 1, i + 1])
+    return len(sql) - len(skipped)
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway test database and measure latency and SQL query counts of the user_utils services. ' \
+           'Fails when a service exceeds its query budget or regresses against the stored baseline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--items', type=int, default=1000, help='Tasks and notes each')
+        parser.add_argument('--audit-rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=20, help='Calls per service')
+        parser.add_argument('--only', nargs='+', choices=sorted(QUERY_BUDGETS), help='Benchmark these services only')
+        parser.add_argument('--baseline', default=getattr(settings, 'BENCHMARK_BASELINE_PATH',
+                                                          os.path.join(settings.BASE_DIR, 'benchmark_baseline.json')))
+        parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed median latency increase over the baseline (0.25 = 25%%)')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database afterwards')
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['items'], options['repeat']) < 1 or options['audit_rows'] < 0:
+            raise CommandError('--users, --items and --repeat must be >= 1 and --audit-rows >= 0')
+
+        # A background audit writer would write into the test database while the services run,
+        # which on SQLite's shared in-memory database fails with "database table is locked"
+        flush_audit_log()
+        with override_settings(AUDIT_LOG_ASYNC=False):
+            results = self.benchmark(options)
+
+        self.report(results)
+        if options['save_baseline']:
+            with open(options['baseline'], 'w') as baseline_file:
+                json.dump(results, baseline_file, indent=2, sort_keys=True)
+            self.stdout.write(f'Baseline saved to {options["baseline"]}')
+
+        failures = self.check_results(results, options['baseline'] if not options['save_baseline'] else None,
+                                      options['tolerance'])
+        if failures:
+            raise CommandError('Benchmark failed:\n  ' + '\n  '.join(failures))
+        self.stdout.write(self.style.SUCCESS('All services within their query budgets and baseline.'))
+
+    def benchmark(self, options):
+        old_name = connection.settings_dict['NAME']
+        # Seeded data never touches the configured database: SQLite benchmarks run in memory,
+        # MySQL ones in a "test_" database on the same server
+        test_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        self.stdout.write(f'Benchmarking against test database {test_name}')
+        try:
+            for cache in caches.all():
+                cache.clear()
+            self.seed(options['users'], options['items'], options['audit_rows'])
+            results = self.run_benchmarks(options['repeat'], options['only'], options['users'], options['items'])
+        finally:
+            flush_audit_log()
+            if not options['keepdb']:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+        return results
+
+    def seed(self, users, items, audit_rows):
+        started_at = time.perf_counter()
+        # One hash for everyone: the benchmark measures the service layer, not bcrypt
+        password_hash = hash_password(BENCH_PASSWORD, rounds=User.get_password_rounds())
+        User.objects.bulk_create(
+            [User(username='bench_admin', password=password_hash, role=RoleChoices.ADMIN)] +
+            [User(username=f'bench_{i:06d}', password=password_hash, role=RoleChoices.USER) for i in range(users)],
+            batch_size=BULK_CHUNK_SIZE)
+        join_role_groups(list(User.objects.only('id', 'role')))
+
+        # Every other row is owned by the admin and hidden from members unless shared
+        admin_id = User.objects.get(username='bench_admin').pk
+        for model in [Task, Note]:
+            model.objects.bulk_create([model(title=f'{model.__name__} {i} benchmark',
+                                             content=f'Seeded {model.__name__.lower()} number {i}',
+                                             owner_id=admin_id if i % 2 else None)
+                                       for i in range(items)], batch_size=BULK_CHUNK_SIZE)
+        member_id = User.objects.get(username='bench_000000').pk
+        shared_ids = Task.objects.filter(owner_id=admin_id).values_list('pk', flat=True)[:100]
+        TaskShare.objects.bulk_create([TaskShare(task_id=task_id, user_id=member_id) for task_id in shared_ids],
+                                      batch_size=BULK_CHUNK_SIZE)
+
+        user_ids = list(User.objects.values_list('id', flat=True))
+        UserActionLog.objects.bulk_create([
+            UserActionLog(user_id=user_ids[i % len(user_ids)], action='view', app='task', details='Seeded')
+            for i in range(audit_rows)], batch_size=BULK_CHUNK_SIZE)
+        self.stdout.write(f'Seeded {users} users, {items} tasks and notes and {audit_rows} audit rows in '
+                          f'{time.perf_counter() - started_at:.1f}s')
+
+    def run_benchmarks(self, repeat, only, users, items):
+        admin = login_user('bench_admin', BENCH_PASSWORD)
+        token = admin.session_token
+        task_ids = list(Task.objects.order_by('pk').values_list('pk', flat=True))
+        usernames = [f'bench_{i:06d}' for i in range(users)]
+        member = login_user(usernames[0], BENCH_PASSWORD)
+        bulk_usernames = usernames[:100]
+
+        services = {
+            'register_user': lambda i: register_user(f'bench_new_{i}', BENCH_PASSWORD, False),
+            'login_user': lambda i: login_user(usernames[i % users], BENCH_PASSWORD),
+            'logout_user': lambda i: logout_user(usernames[i % users]),
+            'authenticate_token': lambda i: authenticate_token(token),
+            'get_user_permissions': lambda i: get_user_permissions(admin, 'task'),
+            'add_user_permission': lambda i: add_user_permission('task', usernames[i % users], 'change'),
+            'remove_user_permission': lambda i: remove_user_permission('task', usernames[i % users], 'change'),
+            'bulk_set_permissions': lambda i: bulk_set_permissions(
+                bulk_usernames, 'note', ['change'],
+                PermissionChangeModes.GRANT if i % 2 == 0 else PermissionChangeModes.REVOKE),
+            'task_list': lambda i: task_list(admin),
+            'task_list_deep_page': lambda i: task_list(admin, after=task_ids[len(task_ids) // 2]),
+            'task_list_member': lambda i: task_list(member),
+            'note_list': lambda i: note_list(admin),
+            'task_detail': lambda i: task_detail(admin, task_ids[0]),
+            'task_search': lambda i: task_search(admin, 'benchmark'),
+            'task_create': lambda i: task_create(admin, {'title': f'Created {i}', 'content': 'benchmark'}),
+            'task_edit': lambda i: task_edit(admin, {'task_id': task_ids[1], 'title': f'Edited {i}',
+                                                     'content': 'benchmark'}),
+            # Deletes from the back so task_detail/task_edit keep their rows
+            'task_delete': lambda i: task_delete(admin, task_ids[items - 1 - i % items]),
+            'task_bulk_create': lambda i: task_bulk_create(admin, [{'title': f'Bulk {i}-{n}'} for n in range(50)]),
+        }
+
+        results = {}
+        for name, service in services.items():
+            if only and name not in only:
+                continue
+            # The first call fills caches and is reported separately
+            first_ms, first_queries = self.measure(service, 0)
+            timings, queries = [], []
+            for i in range(1, repeat + 1):
+                elapsed_ms, query_count = self.measure(service, i)
+                timings.append(elapsed_ms)
+                queries.append(query_count)
+            results[name] = {
+                'first_ms': round(first_ms, 3),
+                'first_queries': first_queries,
+                'median_ms': round(statistics.median(timings), 3),
+                'p95_ms': round(sorted(timings)[max(0, int(len(timings) * 0.95) - 1)], 3),
+                'queries': max(queries),
+            }
+        return results
+
+    @staticmethod
+    def measure(service, i):
+        with CaptureQueriesContext(connection) as context:
+            started_at = time.perf_counter()
+            service(i)
+            elapsed_ms = (time.perf_counter() - started_at) * 1000
+        return elapsed_ms, count_service_queries(context.captured_queries)
+
+    def report(self, results):
+        self.stdout.write(f'{"service":<24}{"first ms":>10}{"first q":>9}{"median ms":>11}{"p95 ms":>10}'
+                          f'{"queries":>9}{"budget":>8}')
+        for name, result in results.items():
+            self.stdout.write(f'{name:<24}{result["first_ms"]:>10.2f}{result["first_queries"]:>9}'
+                              f'{result["median_ms"]:>11.2f}{result["p95_ms"]:>10.2f}{result["queries"]:>9}'
+                              f'{QUERY_BUDGETS[name]:>8}')
+
+    @staticmethod
+    def check_results(results, baseline_path, tolerance):
+        failures = []
+        baseline = {}
+        if baseline_path and os.path.exists(baseline_path):
+            with open(baseline_path) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        for name, result in results.items():
+            if result['queries'] > QUERY_BUDGETS[name]:
+                failures.append(f'{name}: {result["queries"]} queries per call, budget is {QUERY_BUDGETS[name]}')
+            previous = baseline.get(name)
+            if not previous:
+                continue
+            if result['queries'] > previous['queries']:
+                failures.append(f'{name}: {result["queries"]} queries per call, baseline was {previous["queries"]}')
+            if result['median_ms'] > previous['median_ms'] * (1 + tolerance):
+                failures.append(f'{name}: median {result["median_ms"]:.2f}ms, baseline was '
+                                f'{previous["median_ms"]:.2f}ms (+{tolerance:.0%} allowed)')
+        return failures
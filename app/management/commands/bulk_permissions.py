@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.audit_writer import flush_audit_log
+from app.constants import PERMISSION_ACCESSES, PERMISSION_RESOURCES, PermissionChangeModes
+from app.user_utils import bulk_set_permissions
+
+
+class Command(BaseCommand):
+    help = 'Grant or revoke resource permissions for many users in one operation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('mode', choices=PermissionChangeModes.values)
+        parser.add_argument('resource', choices=PERMISSION_RESOURCES)
+        parser.add_argument('--access', action='append', choices=PERMISSION_ACCESSES, required=True,
+                            help='Access to grant/revoke. Repeat for several accesses.')
+        parser.add_argument('--users', nargs='+', default=[], help='Usernames to update')
+        parser.add_argument('--users-file', help='File with one username per line')
+        parser.add_argument('--guarantor', default='system')
+
+    def handle(self, *args, **options):
+        usernames = set(options['users'])
+        if options['users_file']:
+            with open(options['users_file']) as users_file:
+                usernames.update(line.strip() for line in users_file if line.strip())
+        if not usernames:
+            raise CommandError('No usernames given. Use --users or --users-file.')
+
+        try:
+            result = bulk_set_permissions(usernames, options['resource'], options['access'], options['mode'],
+                                          guarantor=options['guarantor'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            flush_audit_log()
+
+        for username in result['missing_users']:
+            self.stdout.write(self.style.WARNING(f'No user exists with uname: {username}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'{options["mode"].capitalize()}: {result["changed"]} permission changes for {result["users"]} users.'))
@@ -0,0 +1,42 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.password_utils import hash_password, verify_password
+
+
+class Command(BaseCommand):
+    help = 'Find the bcrypt work factor whose verification time is closest to, without exceeding, a target latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-ms', type=float, default=250.0)
+        parser.add_argument('--min-rounds', type=int, default=4)
+        parser.add_argument('--max-rounds', type=int, default=16)
+        parser.add_argument('--samples', type=int, default=3)
+
+    def handle(self, *args, **options):
+        password = 'calibrate-bcrypt-1!'
+        chosen = None
+        for rounds in range(options['min_rounds'], options['max_rounds'] + 1):
+            password_hash = hash_password(password, rounds=rounds)
+            timings = []
+            for _ in range(max(1, options['samples'])):
+                started_at = time.perf_counter()
+                verify_password(password, password_hash)
+                timings.append((time.perf_counter() - started_at) * 1000)
+            elapsed_ms = statistics.median(timings)
+            self.stdout.write(f'rounds={rounds:>2}  verify={elapsed_ms:8.1f} ms')
+            if elapsed_ms > options['target_ms']:
+                # Each extra round doubles the cost, so higher values only get slower
+                break
+            chosen = rounds
+
+        if chosen is None:
+            self.stdout.write(self.style.WARNING(
+                f'Even --min-rounds {options["min_rounds"]} takes longer than the {options["target_ms"]:.0f} ms target '
+                f'on this machine. Use BCRYPT_ROUNDS = {options["min_rounds"]} only if that latency is acceptable, '
+                f'or lower --min-rounds (bcrypt accepts 4 and up).'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Recommended setting for a {options["target_ms"]:.0f} ms target: BCRYPT_ROUNDS = {chosen}'))
@@ -0,0 +1,60 @@
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+
+from app.audit_writer import flush_audit_log
+from app.constants import PERMISSION_ACCESSES, PERMISSION_RESOURCES, PermissionChangeModes
+from app.role_permissions import is_role_group, set_group_members, set_group_permissions
+
+ACTIONS = ['show', 'create', 'grant', 'revoke', 'add-members', 'remove-members']
+
+
+class Command(BaseCommand):
+    help = 'Manage the permissions of role groups (ADMIN, USER) and custom groups and the members of custom groups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=ACTIONS)
+        parser.add_argument('group', nargs='?', help='Group name. "show" lists every group when omitted.')
+        parser.add_argument('--resource', choices=PERMISSION_RESOURCES)
+        parser.add_argument('--access', action='append', choices=PERMISSION_ACCESSES,
+                            help='Access to grant/revoke. Repeat for several accesses.')
+        parser.add_argument('--users', nargs='+', default=[], help='Usernames to add or remove')
+        parser.add_argument('--guarantor', default='system')
+
+    def handle(self, *args, **options):
+        action, group = options['action'], options['group']
+        if action == 'show':
+            return self.show(group)
+        if not group:
+            raise CommandError(f'"{action}" needs a group name')
+
+        try:
+            if action == 'create':
+                _, created = Group.objects.get_or_create(name=group)
+                self.stdout.write(self.style.SUCCESS(f'Group "{group}" {"created" if created else "already exists"}.'))
+            elif action in ['grant', 'revoke']:
+                if not options['resource'] or not options['access']:
+                    raise CommandError(f'"{action}" needs --resource and --access')
+                mode = PermissionChangeModes.GRANT if action == 'grant' else PermissionChangeModes.REVOKE
+                codenames = set_group_permissions(group, options['resource'], options['access'], mode,
+                                                  guarantor=options['guarantor'])
+                self.stdout.write(self.style.SUCCESS(f'{action.capitalize()}: {", ".join(codenames)} for "{group}".'))
+            else:
+                if not options['users']:
+                    raise CommandError(f'"{action}" needs --users')
+                result = set_group_members(group, options['users'], add=action == 'add-members')
+                for username in result['missing_users']:
+                    self.stdout.write(self.style.WARNING(f'No user exists with uname: {username}'))
+                self.stdout.write(self.style.SUCCESS(f'{action.capitalize()}: {result["users"]} users in "{group}".'))
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            flush_audit_log()
+
+    def show(self, name):
+        groups = Group.objects.prefetch_related('permissions').order_by('name')
+        if name:
+            groups = groups.filter(name=name)
+        for group in groups:
+            kind = 'role group' if is_role_group(group.name) else f'{group.user_set.count()} members'
+            codenames = sorted(perm.codename for perm in group.permissions.all())
+            self.stdout.write(f'{group.name} ({kind}): {", ".join(codenames) or "-"}')
@@ -0,0 +1,160 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+from app.audit_writer import flush_audit_log, get_audit_writer
+from app.constants import RoleChoices
+from app.models import UserActionLog
+from app.password_utils import hash_password
+from app.role_permissions import join_role_groups
+from app.user_utils import BULK_CHUNK_SIZE
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Import users from a CSV or JSONL file with "username", "password" and optional "role" or "is_admin" ' \
+           'columns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Password hashing processes')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in ['csv', 'jsonl']:
+            raise CommandError(f'Unsupported file format "{file_format}". Use --format csv or --format jsonl.')
+
+        self.source = os.path.basename(path)
+        self.seen_usernames = set()
+        self.imported = self.failed = 0
+        self.workers = max(1, options['workers'])
+        started_at = time.perf_counter()
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            chunk = []
+            for line_no, row in self.read_rows(path, file_format):
+                chunk.append((line_no, row))
+                if len(chunk) >= options['chunk_size']:
+                    self.import_chunk(pool, chunk, started_at)
+                    chunk = []
+            if chunk:
+                self.import_chunk(pool, chunk, started_at)
+        flush_audit_log()
+
+        elapsed = time.perf_counter() - started_at
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.imported} users in {elapsed:.1f}s ({self.imported / max(elapsed, 1e-6):.0f} users/s), '
+            f'{self.failed} rows failed.'))
+
+    def read_rows(self, path, file_format):
+        with open(path, newline='') as users_file:
+            if file_format == 'csv':
+                # Line 1 holds the header row
+                for line_no, row in enumerate(csv.DictReader(users_file), start=2):
+                    yield line_no, row
+                return
+            for line_no, line in enumerate(users_file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError as e:
+                    yield line_no, {'error': f'Invalid JSON: {e}'}
+
+    def report_error(self, line_no, error):
+        self.failed += 1
+        self.stderr.write(f'Line {line_no}: {error}')
+
+    def parse_row(self, row):
+        if not isinstance(row, dict):
+            raise ValueError('Each line must be a JSON object')
+        if row.get('error'):
+            raise ValueError(row['error'])
+        username = row.get('username') or ''
+        password = row.get('password') or ''
+        if not isinstance(username, str) or not isinstance(password, str):
+            raise ValueError('username and password must be strings')
+        username = username.strip()
+        if not username or not password:
+            raise ValueError('Both username and password are required')
+        if username in self.seen_usernames:
+            raise ValueError(f'Duplicate username "{username}" in file')
+
+        role = str(row.get('role') or '').upper()
+        if not role:
+            is_admin = str(row.get('is_admin') or '').lower() in ['y', 'yes', 'true', '1']
+            role = RoleChoices.ADMIN if is_admin else RoleChoices.USER
+        if role not in RoleChoices.values:
+            raise ValueError(f'Invalid role "{role}"')
+        return username, password, role
+
+    def import_chunk(self, pool, chunk, started_at):
+        rows = []
+        for line_no, row in chunk:
+            try:
+                username, password, role = self.parse_row(row)
+            except ValueError as e:
+                self.report_error(line_no, e)
+                continue
+            self.seen_usernames.add(username)
+            rows.append((line_no, username, password, role))
+
+        existing = set(User.objects.filter(username__in=[row[1] for row in rows]).values_list('username', flat=True))
+        for line_no, username, _, _ in rows:
+            if username in existing:
+                self.report_error(line_no, f'User "{username}" already exists')
+        rows = [row for row in rows if row[1] not in existing]
+        if not rows:
+            return
+
+        passwords = [row[2] for row in rows]
+        hashes = pool.map(partial(hash_password, rounds=User.get_password_rounds()), passwords,
+                          chunksize=max(1, len(passwords) // (self.workers * 4)))
+        users = [(line_no, role, User(username=username, password=password_hash, role=role))
+                 for (line_no, username, _, role), password_hash in zip(rows, hashes)]
+
+        try:
+            created = self.create_users([user for _, _, user in users])
+        except IntegrityError:
+            # Someone else created one of the usernames meanwhile; isolate the failing rows
+            created = []
+            for line_no, role, user in users:
+                # The first-admin promotion was rolled back along with the rest of the chunk
+                user.pk, user.role = None, role
+                try:
+                    created += self.create_users([user])
+                except IntegrityError as e:
+                    self.report_error(line_no, e)
+
+        get_audit_writer().write_many([UserActionLog(user=user, action='register', app='app',
+                                                     details=f'Imported from {self.source}') for user in created])
+        self.imported += len(created)
+        elapsed = time.perf_counter() - started_at
+        self.stdout.write(f'{self.imported} users imported ({self.imported / max(elapsed, 1e-6):.0f} users/s)')
+
+    @staticmethod
+    def create_users(users):
+        # Permissions come from the role groups, so only the user and membership rows are written
+        with transaction.atomic():
+            if not any(user.is_admin for user in users) and User.objects.claim_first_admin():
+                users[0].role = RoleChoices.ADMIN
+
+            User.objects.bulk_create(users, batch_size=BULK_CHUNK_SIZE)
+            # bulk_create does not return primary keys on MySQL, so they are read back in one query
+            usernames = [user.username for user in users]
+            ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+            for user in users:
+                user.pk = ids[user.username]
+            join_role_groups(users)
+        return users
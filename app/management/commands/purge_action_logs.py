@@ -0,0 +1,67 @@
+import gzip
+import json
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from app.audit_rollup import get_rollup_watermark, refresh_audit_rollups
+from app.models import UserActionLog
+
+
+class Command(BaseCommand):
+    help = 'Archive UserActionLog rows older than the retention period into gzipped JSONL files and delete them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'AUDIT_LOG_RETENTION_DAYS', 90))
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--archive-dir', default=getattr(settings, 'AUDIT_LOG_ARCHIVE_DIR', 'archive'))
+        parser.add_argument('--no-archive', action='store_true', help='Delete expired rows without archiving them')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['batch_size'] < 1:
+            raise CommandError('--days must be >= 0 and --batch-size >= 1')
+        now = timezone.now()
+        cutoff = now - timedelta(days=options['days'])
+
+        archive = None
+        if not options['no_archive']:
+            os.makedirs(options['archive_dir'], exist_ok=True)
+            path = os.path.join(options['archive_dir'],
+                                f'user_action_log_before_{cutoff:%Y%m%d}_{now:%Y%m%d%H%M%S}.jsonl.gz')
+            archive = gzip.open(path, 'at', encoding='utf-8')
+            self.stdout.write(f'Archiving rows older than {cutoff} to {path}')
+
+        # Expired rows are counted into the rollups first and only rows below the watermark are
+        # deleted, so the daily reports stay complete after the raw rows are gone
+        refresh_audit_rollups()
+        watermark = get_rollup_watermark()
+
+        total, last_id = 0, 0
+        try:
+            while True:
+                rows = list(UserActionLog.objects
+                            .filter(timestamp__lt=cutoff, id__gt=last_id, id__lte=watermark).order_by('id')
+                            .values('id', 'user_id', 'timestamp', 'action', 'app', 'details')[:options['batch_size']])
+                if not rows:
+                    break
+                if archive:
+                    for row in rows:
+                        archive.write(json.dumps(row, default=str) + '\n')
+                    # Rows must be on disk before they are deleted
+                    archive.flush()
+                    os.fsync(archive.buffer.fileobj.fileno())
+                # One short transaction per batch keeps locks on the hot table brief
+                with transaction.atomic():
+                    UserActionLog.objects.filter(id__in=[row['id'] for row in rows]).delete()
+                last_id = rows[-1]['id']
+                total += len(rows)
+                self.stdout.write(f'{total} rows purged')
+        finally:
+            if archive:
+                archive.close()
+
+        self.stdout.write(self.style.SUCCESS(f'Purged {total} audit log rows older than {options["days"]} days.'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from app.role_permissions import backfill_role_memberships, ensure_role_groups, prune_role_covered_permissions
+
+
+class Command(BaseCommand):
+    help = 'Create the role groups and optionally drop per-user permission rows that the role already grants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset-defaults', action='store_true',
+                            help='Reset the grants of the role groups to the defaults')
+        parser.add_argument('--prune', action='store_true',
+                            help='Delete per-user permission rows covered by the user\'s groups')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows --prune would delete')
+
+    def handle(self, *args, **options):
+        initialised = ensure_role_groups(reset=options['reset_defaults'])
+        if initialised:
+            self.stdout.write(f'Default permissions set for: {", ".join(initialised)}')
+        added = backfill_role_memberships()
+        if added:
+            self.stdout.write(f'Added {added} users to the groups of their roles.')
+        if options['prune']:
+            removed = prune_role_covered_permissions(dry_run=options['dry_run'])
+            verb = 'Would delete' if options['dry_run'] else 'Deleted'
+            self.stdout.write(f'{verb} {removed} per-user permission rows covered by role groups.')
+        self.stdout.write(self.style.SUCCESS('Role groups are in sync.'))
@@ -3,6 +3,7 @@ LOGIN_USER_OPTION = 'LI'
 LOGOUT_USER_OPTION = 'LO'
 EXIT_USER_OPTION = '-1'
 HOME_PAGE_OPTION = 'HP'
+NEXT_PAGE_OPTION = 'NX'
 ADMIN_PANEL_OPTION = 'A'
 ADMIN_PAGE = 'PO'
 HOME_PAGE = 'P1'
@@ -12,10 +13,12 @@ TASKS_PAGE = 'P3-T'
 NOTES = 'N'
 TASKS = 'T'
 NOTE_DETAIL = 'ND'
+SEARCH_NOTES = 'SN'
 CREATE_NOTE = 'CN'
 UPDATE_NOTE = 'UN'
 DELETE_NOTE = 'DN'
 TASK_DETAIL = 'TD'
+SEARCH_TASKS = 'ST'
 CREATE_TASK = 'CT'
 UPDATE_TASK = 'UT'
 DELETE_TASK = 'DT'
@@ -0,0 +1,291 @@
+import atexit
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:
+    # Not POSIX, where snapshots are not retired either (see _process_alive)
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+def _db_totals():
+    return getattr(_local, 'queries', 0), getattr(_local, 'db_seconds', 0.0)
+
+
+def count_queries(execute, sql, params, many, context):
+    """connection.execute_wrapper that keeps per-thread query count and DB time totals."""
+    started_at = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        _local.queries = getattr(_local, 'queries', 0) + 1
+        _local.db_seconds = getattr(_local, 'db_seconds', 0.0) + time.perf_counter() - started_at
+
+
+def install_query_counter(sender, connection, **kwargs):
+    # connection_created receiver: every new DB connection reports into the counters above
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def new_operation_stats():
+    return {'calls': 0, 'errors': 0, 'seconds': 0.0, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+            'queries': 0, 'db_seconds': 0.0}
+
+
+def merge_operation_stats(target, stats):
+    for key in ['calls', 'errors', 'seconds', 'queries', 'db_seconds']:
+        target[key] += stats[key]
+    target['buckets'] = [a + b for a, b in zip(target['buckets'], stats['buckets'])]
+    return target
+
+
+class OperationMetrics:
+    """
+    Process-wide call count, latency histogram, query count and DB time per operation.
+    Snapshots are written to `<directory>/metrics-<pid>.json` every `dump_interval`
+    seconds by a background thread and at exit, so `manage.py access_stats` can add up
+    every process without the request path doing file I/O.
+    """
+
+    def __init__(self, directory, dump_interval=30.0):
+        self.directory = directory
+        self.dump_interval = dump_interval
+        self.started_at = time.time()
+        self._operations = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record(self, operation, seconds, queries, db_seconds, error=False):
+        with self._lock:
+            stats = self._operations.get(operation)
+            if stats is None:
+                stats = self._operations[operation] = new_operation_stats()
+            stats['calls'] += 1
+            stats['errors'] += bool(error)
+            stats['seconds'] += seconds
+            stats['buckets'][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            stats['queries'] += queries
+            stats['db_seconds'] += db_seconds
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='metrics-dump', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.dump_interval)
+            self.dump()
+
+    def snapshot(self):
+        with self._lock:
+            return {operation: dict(stats, buckets=list(stats['buckets']))
+                    for operation, stats in self._operations.items()}
+
+    def dump(self):
+        if not self._operations:
+            return
+        data = {'pid': os.getpid(), 'started_at': self.started_at, 'updated_at': time.time(),
+                'operations': self.snapshot()}
+        path = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(f'{path}.tmp', 'w') as metrics_file:
+                json.dump(data, metrics_file)
+            os.replace(f'{path}.tmp', path)
+        except OSError as e:
+            logger.warning(f'Could not write metrics to {path}: {e}')
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics_dir():
+    return getattr(settings, 'METRICS_DIR', os.path.join(settings.LOG_DIR, 'metrics'))
+
+
+def get_metrics():
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = OperationMetrics(get_metrics_dir(), getattr(settings, 'METRICS_DUMP_INTERVAL', 30.0))
+                atexit.register(_metrics.dump)
+    return _metrics
+
+
+def instrument(operation):
+    def decorator(func):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            return func
+
+        def wrapper(*args, **kwargs):
+            queries, db_seconds = _db_totals()
+            started_at = time.perf_counter()
+            error = True
+            try:
+                result = func(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                elapsed = time.perf_counter() - started_at
+                end_queries, end_db_seconds = _db_totals()
+                get_metrics().record(operation, elapsed, end_queries - queries, end_db_seconds - db_seconds, error)
+
+        return wrapper
+
+    return decorator
+
+
+RETIRED_SNAPSHOT = 'retired.json'
+
+
+def _process_alive(pid):
+    # os.kill() on Windows terminates the process instead of probing it
+    if pid == os.getpid() or os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running under another user
+        return True
+    return True
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as metrics_file:
+            return json.load(metrics_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _retire_snapshots(directory, paths):
+    """
+    Folds the snapshots of exited processes into `retired.json` and deletes them. The last
+    batch folded is remembered by pid and start time, so a crash before the deletes does not
+    count it twice on the next run.
+    """
+    retired_path = os.path.join(directory, RETIRED_SNAPSHOT)
+    with open(os.path.join(directory, 'metrics.lock'), 'w') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        retired = _read_snapshot(retired_path) or {'processes': 0, 'folded': [], 'operations': {}}
+        folded = {tuple(process) for process in retired['folded']}
+        batch = []
+        for path in paths:
+            data = _read_snapshot(path)
+            if data is None:
+                # Retired by another aggregator in the meantime
+                continue
+            process = (data['pid'], data['started_at'])
+            batch.append(process)
+            if process not in folded:
+                folded.add(process)
+                retired['processes'] += 1
+                for operation, stats in data['operations'].items():
+                    merge_operation_stats(retired['operations'].setdefault(operation, new_operation_stats()), stats)
+        retired['folded'] = batch
+        with open(f'{retired_path}.tmp', 'w') as metrics_file:
+            json.dump(retired, metrics_file)
+        os.replace(f'{retired_path}.tmp', retired_path)
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def load_metrics(directory=None):
+    """
+    Adds up the snapshots of every process that wrote one to `directory`. Snapshots of
+    exited processes are folded into a single retired snapshot so they don't pile up.
+    """
+    directory = directory or get_metrics_dir()
+    snapshots, exited = [], []
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+        data = _read_snapshot(path)
+        if data is None:
+            continue
+        if _process_alive(data['pid']):
+            snapshots.append(data)
+        else:
+            exited.append(path)
+    if exited:
+        try:
+            _retire_snapshots(directory, exited)
+        except OSError as e:
+            logger.warning(f'Could not retire metrics snapshots in {directory}: {e}')
+
+    operations, processes = {}, len(snapshots)
+    retired = _read_snapshot(os.path.join(directory, RETIRED_SNAPSHOT))
+    if retired:
+        processes += retired['processes']
+        snapshots.append(retired)
+    for data in snapshots:
+        for operation, stats in data['operations'].items():
+            merge_operation_stats(operations.setdefault(operation, new_operation_stats()), stats)
+    return operations, processes
+
+
+def reset_metrics(directory=None):
+    directory = directory or get_metrics_dir()
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')) + [os.path.join(directory, RETIRED_SNAPSHOT)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def format_prometheus(operations):
+    lines = []
+
+    def metric(name, metric_type, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        lines.extend(samples)
+
+    ops = sorted(operations.items())
+    metric('app_operation_calls_total', 'counter', 'Calls per service operation.',
+           [f'app_operation_calls_total{{operation="{op}"}} {stats["calls"]}' for op, stats in ops])
+    metric('app_operation_errors_total', 'counter', 'Calls that raised an exception.',
+           [f'app_operation_errors_total{{operation="{op}"}} {stats["errors"]}' for op, stats in ops])
+
+    samples = []
+    for op, stats in ops:
+        cumulative = 0
+        for bound, count in zip(list(LATENCY_BUCKETS) + ['+Inf'], stats['buckets']):
+            cumulative += count
+            samples.append(f'app_operation_latency_seconds_bucket{{operation="{op}",le="{bound}"}} {cumulative}')
+        samples.append(f'app_operation_latency_seconds_sum{{operation="{op}"}} {stats["seconds"]:.6f}')
+        samples.append(f'app_operation_latency_seconds_count{{operation="{op}"}} {stats["calls"]}')
+    metric('app_operation_latency_seconds', 'histogram', 'Service operation latency.', samples)
+
+    metric('app_operation_db_queries_total', 'counter', 'SQL queries run by service operations.',
+           [f'app_operation_db_queries_total{{operation="{op}"}} {stats["queries"]}' for op, stats in ops])
+    metric('app_operation_db_seconds_total', 'counter', 'Time spent in SQL queries by service operations.',
+           [f'app_operation_db_seconds_total{{operation="{op}"}} {stats["db_seconds"]:.6f}' for op, stats in ops])
+    return '\n'.join(lines) + '\n'
@@ -1,16 +1,40 @@
 from django.contrib.auth.base_user import BaseUserManager
 
 from app.constants import UserStatus, ROLE_CHOICES, RoleChoices
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
-from django.contrib.auth.models import AbstractUser
-from bcrypt import checkpw, gensalt, hashpw
+from django.contrib.auth.models import AbstractUser, Permission
+from app.password_utils import DEFAULT_ROUNDS, hash_password, needs_rehash, verify_password
+from django.conf import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
 
 class UserManager(BaseUserManager):
+    def admin_exists(self):
+        return self.filter(role=RoleChoices.ADMIN).exists()
+
+    def claim_first_admin(self):
+        """
+        True when no admin exists, checked while holding the FirstAdminClaim row lock until the
+        caller's transaction ends. Concurrent claims wait on that lock, so only one of them can
+        see "no admin" and promote its user; once the last admin is deleted or demoted the next
+        claim succeeds again.
+        """
+        if self.admin_exists():
+            return False
+        with transaction.atomic():
+            # The UPDATE takes the row lock (SQLite: the database write lock)
+            if not FirstAdminClaim.objects.filter(id=FirstAdminClaim.ID).update(claimed_at=timezone.now()):
+                try:
+                    with transaction.atomic():
+                        FirstAdminClaim.objects.create(id=FirstAdminClaim.ID)
+                except IntegrityError:
+                    FirstAdminClaim.objects.filter(id=FirstAdminClaim.ID).update(claimed_at=timezone.now())
+            # A locking read sees admins committed by the claim we may have waited for
+            return not self.filter(role=RoleChoices.ADMIN).select_for_update().exists()
+
     def create_user(self, username, password, role, **extra_fields):
         user = self.model(username=username, role=role, **extra_fields)
         user.set_password(password)
@@ -36,7 +60,7 @@ class User(AbstractUser):
     username = models.CharField(max_length=255, unique=True)
     password = models.CharField(max_length=255, blank=True)
     date_joined = models.DateTimeField(default=timezone.now)
-    role = models.CharField(max_length=10, choices=ROLE_CHOICES, default=RoleChoices.USER)
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES, default=RoleChoices.USER, db_index=True)
     is_active = models.BooleanField(default=False)
 
     objects = UserManager()
@@ -44,26 +68,35 @@ class User(AbstractUser):
     def _str_(self):
         return self.username
 
+    @staticmethod
+    def get_password_rounds():
+        return getattr(settings, 'BCRYPT_ROUNDS', DEFAULT_ROUNDS)
+
     @staticmethod
     def generate_password_hash(password):
-        password_bytes = password.encode('utf-8')
-        generated_salt = gensalt()
-        password_hash = hashpw(password_bytes, generated_salt)
-        return password_hash
+        return hash_password(password, rounds=User.get_password_rounds()).encode('utf-8')
 
     def set_password(self, password):
         password_hash = self.generate_password_hash(password)
         self.password = password_hash.decode('utf-8')
 
     def check_password(self, password):
-        if checkpw(password.encode('utf-8'), self.password.encode('utf-8')):
+        if verify_password(password, self.password):
             return True
         return False
 
-    def log_in(self, password):
-        if self.password and not self.check_password(password):
+    def log_in(self, password, verified=None):
+        # `verified` is the outcome of a password check the caller already ran (e.g. outside a transaction)
+        if verified is False:
+            return False
+        if verified is None and self.password and not self.check_password(password):
             # Already Registered user with wrong credentials
             return False
+        if verified is None and self.password and needs_rehash(self.password, self.get_password_rounds()):
+            # Hash stored with an outdated work factor -> upgrade it while the plain password is at hand
+            self.set_password(password)
+            self.save(update_fields=['password'])
+            logger.info(f'Password hash of user "{self.username}" upgraded to {self.get_password_rounds()} rounds')
         self.is_active = True
         # No password set -> User Registration OR password match
         return True
@@ -78,11 +111,37 @@ class User(AbstractUser):
 
     def save(self, *args, **kwargs):
         # Add validation such as if user already exists
-        if User.objects.filter(role__in=[RoleChoices.ADMIN]).count() == 0:
-            self.role = RoleChoices.ADMIN
-            self.status = UserStatus.ACTIVATED
-            print("This user is set up as ADMIN role by default as there are no other admin roles.")
-        return super(User, self).save(*args, **kwargs)
+        if not self._state.adding:
+            return super(User, self).save(*args, **kwargs)
+
+        from app.role_permissions import join_role_groups
+        with transaction.atomic():
+            if not self.is_admin and User.objects.claim_first_admin():
+                self.role = RoleChoices.ADMIN
+                self.status = UserStatus.ACTIVATED
+                print("This user is set up as ADMIN role by default as there are no other admin roles.")
+            super(User, self).save(*args, **kwargs)
+            # Permissions are inherited from the group of the (final) role
+            join_role_groups([self])
+
+
+class FirstAdminClaim(models.Model):
+    # At most one row, locked by UserManager.claim_first_admin() to serialize first-admin promotions
+    ID = 1
+
+    id = models.PositiveSmallIntegerField(primary_key=True, default=ID)
+    claimed_at = models.DateTimeField(default=timezone.now)
+
+
+class UserPermissionExclusion(models.Model):
+    # Revokes a permission the user would otherwise inherit from one of their groups
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='permission_exclusions')
+    permission = models.ForeignKey(Permission, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'permission'], name='user_permission_exclusion_unique'),
+        ]
 
 
 class UserActionLog(models.Model):
@@ -92,11 +151,55 @@ class UserActionLog(models.Model):
     app = models.CharField(max_length=255, blank=True)
     details = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'timestamp'], name='action_log_user_time_idx'),
+            models.Index(fields=['action', 'timestamp'], name='action_log_action_time_idx'),
+            # Used by retention to find the rows older than the cutoff
+            models.Index(fields=['timestamp'], name='action_log_time_idx'),
+        ]
+
+
+class UserActionRollup(models.Model):
+    # Daily UserActionLog counts, maintained by app.audit_rollup.refresh_audit_rollups()
+    day = models.DateField()
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    action = models.CharField(max_length=255)
+    app = models.CharField(max_length=255, blank=True)
+    # Digest of (user, action, app) from app.audit_rollup.rollup_key(), since the nullable user
+    # column cannot back the unique constraint on every database
+    key = models.CharField(max_length=40, editable=False)
+    count = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'key'], name='action_rollup_day_key_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'action'], name='action_rollup_day_action_idx'),
+            models.Index(fields=['user', 'day'], name='action_rollup_user_day_idx'),
+        ]
+
+
+class AuditRollupWatermark(models.Model):
+    # Highest UserActionLog id already counted into UserActionRollup
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
 
 class Task(models.Model):
     id = models.AutoField(primary_key=True)
     title = models.CharField(max_length=255)
     content = models.TextField()
+    # Tasks created before ownership existed have no owner: visible to everyone, changed by admins only
+    owner = models.ForeignKey(User, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+
+    class Meta:
+        indexes = [
+            # Keyset pages of one owner's tasks
+            models.Index(fields=['owner', 'id'], name='task_owner_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.id} : {self.title}"
@@ -106,6 +209,44 @@ class Note(models.Model):
     id = models.AutoField(primary_key=True)
     title = models.CharField(max_length=255)
     content = models.TextField()
+    # Notes created before ownership existed have no owner: visible to everyone, changed by admins only
+    owner = models.ForeignKey(User, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+
+    class Meta:
+        indexes = [
+            # Keyset pages of one owner's notes
+            models.Index(fields=['owner', 'id'], name='note_owner_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.id} : {self.title}"
+
+
+class TaskShare(models.Model):
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='shares')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    can_edit = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            # Also serves the (task, user) visibility lookups
+            models.UniqueConstraint(fields=['task', 'user'], name='task_share_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'task'], name='task_share_user_idx'),
+        ]
+
+
+class NoteShare(models.Model):
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='shares')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    can_edit = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            # Also serves the (note, user) visibility lookups
+            models.UniqueConstraint(fields=['note', 'user'], name='note_share_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'note'], name='note_share_user_idx'),
+        ]
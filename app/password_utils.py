@@ -0,0 +1,25 @@
+from bcrypt import checkpw, gensalt, hashpw
+
+# Kept free of Django imports so hashing can run in worker processes that never call django.setup()
+
+DEFAULT_ROUNDS = 12
+
+
+def hash_password(password, rounds=DEFAULT_ROUNDS):
+    return hashpw(password.encode('utf-8'), gensalt(rounds=rounds)).decode('utf-8')
+
+
+def verify_password(password, password_hash):
+    return checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+def get_hash_rounds(password_hash):
+    # bcrypt hashes look like "$2b$12$<salt><hash>" where 12 is the work factor
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def needs_rehash(password_hash, rounds):
+    return get_hash_rounds(password_hash) != rounds
@@ -0,0 +1,108 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Permission
+from django.core.cache import caches
+from django.db.models import Q
+
+from app.models import UserPermissionExclusion
+
+
+_permissions_by_codename = {}
+_permissions_lock = threading.Lock()
+
+
+def get_permissions_by_codename():
+    # Permission rows only change with migrations, so they are loaded once per process
+    if not _permissions_by_codename:
+        with _permissions_lock:
+            if not _permissions_by_codename:
+                _permissions_by_codename.update(
+                    {perm.codename: perm for perm in Permission.objects.filter(content_type__app_label='app')})
+    return _permissions_by_codename
+
+
+def _cache():
+    return caches[getattr(settings, 'PERMISSION_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'PERMISSION_CACHE_TIMEOUT', 300)
+
+
+def _version_key(user_id):
+    return f'perm_version:{user_id}'
+
+
+# Shared by every user: bumped whenever the permissions of any group change
+GROUPS_VERSION_KEY = 'perm_groups_version'
+
+
+def _perms_key(user_id, version, groups_version):
+    return f'perms:{user_id}:{version}:{groups_version}'
+
+
+def _new_version():
+    # Time based versions stay unique even if the version key itself gets evicted
+    return time.time_ns()
+
+
+def get_permission_versions(user_id):
+    cache = _cache()
+    keys = [_version_key(user_id), GROUPS_VERSION_KEY]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, _new_version(), None)
+        versions.update(cache.get_many(missing))
+    return versions.get(keys[0]), versions.get(keys[1])
+
+
+def load_permissions(user_id):
+    # Direct grants and the grants of the user's groups (the role group included), minus exclusions
+    excluded = UserPermissionExclusion.objects.filter(user_id=user_id).values('permission_id')
+    perms = Permission.objects.filter(Q(user__id=user_id) | Q(group__user__id=user_id)).exclude(pk__in=excluded)
+    perms = perms.values_list('content_type__app_label', 'codename').distinct()
+    return frozenset(f'{app_label}.{codename}' for app_label, codename in perms)
+
+
+def get_cached_permissions(user):
+    """
+    Returns every permission of the user ("app.view_task", ...) from the shared
+    permission cache, loading it from the auth tables on a miss.
+    """
+    if not user.is_active:
+        return frozenset()
+    cache = _cache()
+    key = _perms_key(user.pk, *get_permission_versions(user.pk))
+    perms = cache.get(key)
+    if perms is None:
+        perms = load_permissions(user.pk)
+        cache.set(key, perms, _timeout())
+    return perms
+
+
+def has_cached_perm(user, perm):
+    if user.is_active and user.is_superuser:
+        return True
+    return perm in get_cached_permissions(user)
+
+
+def invalidate_user_permissions(*user_ids):
+    _cache().set_many({_version_key(user_id): _new_version() for user_id in user_ids}, None)
+
+
+def invalidate_group_permissions():
+    _cache().set(GROUPS_VERSION_KEY, _new_version(), None)
+
+
+class CachedPermissionBackend(ModelBackend):
+    """ModelBackend answering user.has_perm() from the permission cache, so it honours exclusions too."""
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if user_obj.is_anonymous or obj is not None:
+            return set()
+        return set(get_cached_permissions(user_obj))
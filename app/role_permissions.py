@@ -0,0 +1,173 @@
+import logging
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from app.audit_writer import get_audit_writer
+from app.constants import PERMISSION_ACCESSES, PERMISSION_RESOURCES, PermissionChangeModes, RoleChoices
+from app.models import UserActionLog, UserPermissionExclusion
+from app.permission_cache import invalidate_group_permissions, invalidate_user_permissions
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+CHUNK_SIZE = 500
+
+# Grants of the role groups when they are first created
+ROLE_DEFAULT_ACCESSES = {
+    RoleChoices.ADMIN: PERMISSION_ACCESSES,
+    RoleChoices.USER: ['view'],
+}
+
+
+def default_role_codenames(role):
+    return [f'{access}_{resource}' for resource in PERMISSION_RESOURCES for access in ROLE_DEFAULT_ACCESSES[role]]
+
+
+def is_role_group(name):
+    return name in RoleChoices.values
+
+
+def ensure_role_groups(using=DEFAULT_DB_ALIAS, reset=False):
+    """
+    Creates one auth Group per RoleChoices value with the default grants. Users are members
+    of the group of their role (see join_role_groups). Existing groups keep their grants
+    unless `reset` is set. Returns the names of the groups that were (re)initialised.
+    """
+    permissions = {perm.codename: perm for perm in
+                   Permission.objects.using(using).filter(content_type__app_label='app')}
+    initialised = []
+    for role in RoleChoices.values:
+        group, created = Group.objects.using(using).get_or_create(name=role)
+        if created or reset:
+            group.permissions.set([permissions[codename] for codename in default_role_codenames(role)
+                                   if codename in permissions])
+            initialised.append(role)
+    if initialised:
+        invalidate_group_permissions()
+        logger.info(f'Default permissions set for role groups {", ".join(initialised)} at {timezone.now()}')
+    return initialised
+
+
+def join_role_groups(users, using=DEFAULT_DB_ALIAS):
+    # Membership rows of freshly created users; existing rows are left alone
+    groups = dict(Group.objects.using(using).filter(name__in={user.role for user in users}).values_list('name', 'id'))
+    through = User.groups.through
+    through.objects.using(using).bulk_create([through(user_id=user.pk, group_id=groups[user.role])
+                                              for user in users if user.role in groups],
+                                             batch_size=CHUNK_SIZE, ignore_conflicts=True)
+
+
+def backfill_role_memberships(using=DEFAULT_DB_ALIAS):
+    """
+    Adds users that are not members of the group of their role to it. Users registered before
+    role groups existed were given the role defaults as per-user rows, so when such a user still
+    holds some of them, the defaults they lack had been revoked and are kept revoked with
+    exclusion rows. Returns the number of users added.
+    """
+    permission_ids = dict(Permission.objects.using(using).filter(content_type__app_label='app')
+                          .values_list('codename', 'id'))
+    memberships, user_permissions = User.groups.through, User.user_permissions.through
+    added = 0
+    for role in RoleChoices.values:
+        group = Group.objects.using(using).filter(name=role).first()
+        if group is None:
+            continue
+        default_ids = {permission_ids[codename] for codename in default_role_codenames(role)
+                       if codename in permission_ids}
+        user_ids = list(User.objects.using(using).filter(role=role).exclude(groups=group).values_list('pk', flat=True))
+        for i in range(0, len(user_ids), CHUNK_SIZE):
+            chunk = user_ids[i:i + CHUNK_SIZE]
+            held = set(user_permissions.objects.using(using).filter(user_id__in=chunk)
+                       .values_list('user_id', 'permission_id'))
+            legacy_user_ids = {user_id for user_id, permission_id in held if permission_id in default_ids}
+            with transaction.atomic(using=using):
+                memberships.objects.using(using).bulk_create(
+                    [memberships(user_id=user_id, group_id=group.pk) for user_id in chunk], ignore_conflicts=True)
+                UserPermissionExclusion.objects.using(using).bulk_create(
+                    [UserPermissionExclusion(user_id=user_id, permission_id=permission_id)
+                     for user_id in legacy_user_ids for permission_id in default_ids
+                     if (user_id, permission_id) not in held], ignore_conflicts=True)
+            added += len(chunk)
+    if added:
+        invalidate_group_permissions()
+        logger.info(f'Added {added} users to the groups of their roles at {timezone.now()}')
+    return added
+
+
+def inherited_permission_pairs(user_ids, permission_ids):
+    """(user_id, permission_id) pairs among the given ones that a group of the user grants."""
+    grants = Group.permissions.through.objects.filter(group__user__id__in=user_ids, permission_id__in=permission_ids)
+    return set(grants.values_list('group__user__id', 'permission_id'))
+
+
+def get_group(name):
+    group = Group.objects.filter(name=name).first()
+    if group is None:
+        raise ValueError(f'No group exists with name: {name}')
+    return group
+
+
+def set_group_permissions(group_name, resource, accesses, mode, guarantor='system'):
+    """Grants or revokes resource accesses of a group: one write, whatever the number of members."""
+    if mode not in PermissionChangeModes.values:
+        raise ValueError(f'Invalid mode "{mode}". Choose from: {", ".join(PermissionChangeModes.values)}')
+    codenames = {f'{access}_{resource}' for access in accesses}
+    permissions = list(Permission.objects.filter(content_type__app_label='app', codename__in=codenames))
+    missing_codenames = codenames - {perm.codename for perm in permissions}
+    if missing_codenames:
+        raise ValueError(f'Unknown permissions: {", ".join(sorted(missing_codenames))}')
+    group = get_group(group_name)
+
+    with transaction.atomic():
+        if mode == PermissionChangeModes.GRANT:
+            group.permissions.add(*permissions)
+            verb = 'Granted'
+        else:
+            group.permissions.remove(*permissions)
+            verb = 'Revoked'
+        entries = [UserActionLog(user=None, action=perm.codename.split('_')[0], app=resource,
+                                 details=f'{verb} app.{perm.codename} permission to group {group_name} by {guarantor}')
+                   for perm in permissions]
+        transaction.on_commit(invalidate_group_permissions)
+        transaction.on_commit(lambda: get_audit_writer().write_many(entries))
+
+    logger.info(f'{verb} {", ".join(sorted(codenames))} to group "{group_name}" by {guarantor} at {timezone.now()}')
+    return sorted(codenames)
+
+
+def set_group_members(group_name, usernames, add=True):
+    if is_role_group(group_name):
+        raise ValueError(f'Members of role group "{group_name}" follow the user role and cannot be changed')
+    group = get_group(group_name)
+    usernames = set(usernames)
+    users = list(User.objects.filter(username__in=usernames).only('id', 'username'))
+
+    with transaction.atomic():
+        if add:
+            group.user_set.add(*users)
+        else:
+            group.user_set.remove(*users)
+        user_ids = [user.pk for user in users]
+        transaction.on_commit(lambda: invalidate_user_permissions(*user_ids))
+
+    return {'users': len(users), 'missing_users': sorted(usernames - {user.username for user in users})}
+
+
+def prune_role_covered_permissions(dry_run=False):
+    """
+    Deletes per-user permission rows that a group of the user already grants. Effective
+    permissions do not change, so no cache needs invalidating. Returns the rows removed.
+    """
+    through = User.user_permissions.through
+    group_grants = Group.permissions.through.objects.filter(group__user__id=OuterRef('user_id'),
+                                                            permission_id=OuterRef('permission_id'))
+    with transaction.atomic():
+        rows = through.objects.filter(Exists(group_grants))
+        removed = rows.count() if dry_run else rows.delete()[0]
+    if removed and not dry_run:
+        logger.info(f'Pruned {removed} per-user permission rows covered by role groups at {timezone.now()}')
+    return removed
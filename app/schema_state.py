@@ -0,0 +1,67 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _state_file():
+    return getattr(settings, 'SCHEMA_STATE_FILE', os.path.join(settings.BASE_DIR, '.schema_state.json'))
+
+
+def _migration_files():
+    return sorted(os.path.basename(path) for path in glob.glob(os.path.join(APP_DIR, 'migrations', '[0-9]*.py')))
+
+
+def schema_fingerprint():
+    # Hashes what makemigrations would look at plus the database it would run against
+    digest = hashlib.sha256()
+    with open(os.path.join(APP_DIR, 'models.py'), 'rb') as models_file:
+        digest.update(models_file.read())
+    db = connection.settings_dict
+    digest.update(f'{db["ENGINE"]}|{db.get("HOST")}|{db.get("PORT")}|{db["NAME"]}'.encode('utf-8'))
+    digest.update('|'.join(_migration_files()).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _applied_migrations():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM django_migrations WHERE app = %s', ['app'])
+        return cursor.fetchone()[0]
+
+
+def schema_is_current():
+    """
+    True when models.py, the migration files and the database are unchanged since the last
+    record_schema_state() and every migration file is applied. Costs one COUNT query.
+    """
+    try:
+        with open(_state_file()) as state_file:
+            state = json.load(state_file)
+    except (OSError, ValueError):
+        return False
+    if state.get('fingerprint') != schema_fingerprint():
+        return False
+    try:
+        return _applied_migrations() == state.get('applied') == len(_migration_files())
+    except DatabaseError as e:
+        logger.info(f'Schema check failed, running migrations: {e}')
+        return False
+
+
+def record_schema_state():
+    path = _state_file()
+    state = {'fingerprint': schema_fingerprint(), 'applied': _applied_migrations()}
+    try:
+        with open(f'{path}.tmp', 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(f'{path}.tmp', path)
+    except OSError as e:
+        logger.warning(f'Could not write schema state to {path}: {e}')
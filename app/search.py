@@ -0,0 +1,90 @@
+import logging
+
+from django.db import connections, DatabaseError
+
+from app.models import Task, Note
+
+logger = logging.getLogger(__name__)
+
+SEARCH_MODELS = [Task, Note]
+
+# External content FTS5 table kept in sync with the model table by triggers, so every
+# write path (ORM, bulk operations, raw SQL) updates the index in the same transaction
+SQLITE_FTS_STATEMENTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(title, content, content='{table}', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+    "INSERT INTO {fts}(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); "
+    "INSERT INTO {fts}(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+]
+
+
+def _fts_table(model):
+    return f'{model._meta.db_table}_fts'
+
+
+def _fulltext_index(model):
+    return f'{model._meta.db_table}_fulltext'
+
+
+def _install_sqlite_index(cursor, model):
+    table, fts = model._meta.db_table, _fts_table(model)
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [fts])
+    exists = cursor.fetchone()
+    for statement in SQLITE_FTS_STATEMENTS:
+        cursor.execute(statement.format(table=table, fts=fts))
+    if not exists:
+        # Index the rows written before the FTS table existed
+        cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def _install_mysql_index(cursor, model):
+    table, index = model._meta.db_table, _fulltext_index(model)
+    cursor.execute("SELECT 1 FROM information_schema.statistics WHERE table_schema = DATABASE() "
+                   "AND table_name = %s AND index_name = %s LIMIT 1", [table, index])
+    if not cursor.fetchone():
+        cursor.execute(f'ALTER TABLE {table} ADD FULLTEXT INDEX {index} (title, content)')
+
+
+def install_search_indexes(using='default'):
+    connection = connections[using]
+    installers = {'sqlite': _install_sqlite_index, 'mysql': _install_mysql_index}
+    if connection.vendor not in installers:
+        logger.warning(f'Full-text search is not supported on {connection.vendor}')
+        return
+    try:
+        with connection.cursor() as cursor:
+            for model in SEARCH_MODELS:
+                installers[connection.vendor](cursor, model)
+    except DatabaseError as e:
+        logger.error(f'Failed to install full-text search indexes: {e}')
+
+
+def _fts5_query(query):
+    # Every term is quoted so user input can't use (or break on) the FTS5 query syntax
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in query.split())
+
+
+def search_queryset(queryset, query):
+    """
+    Filters `queryset` down to the rows matching `query` through the native full-text
+    index and orders them by relevance.
+    """
+    if not query or not query.strip():
+        raise ValueError('Search query must not be empty')
+    model = queryset.model
+    table = model._meta.db_table
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        fts = _fts_table(model)
+        return queryset.extra(select={'rank': f'bm25({fts})'}, tables=[fts],
+                              where=[f'{fts}.rowid = {table}.id', f'{fts} MATCH %s'], params=[_fts5_query(query)],
+                              order_by=['rank'])
+    if vendor == 'mysql':
+        match = f'MATCH ({table}.title, {table}.content) AGAINST (%s IN NATURAL LANGUAGE MODE)'
+        return queryset.extra(select={'rank': match}, select_params=[query], where=[match], params=[query],
+                              order_by=['-rank'])
+    raise ValueError(f'Full-text search is not supported on {vendor}')
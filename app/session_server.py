@@ -0,0 +1,133 @@
+import asyncio
+import concurrent.futures
+import logging
+
+from django.db import connection
+
+from app.management.commands.access_manager import Command
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStream:
+    """
+    File-like object that hands writes from a session thread over to the event loop. Each
+    write waits for the socket buffer to drain, so a slow client slows its own session down
+    instead of growing the buffer without limit.
+    """
+
+    def __init__(self, loop, writer, timeout):
+        self.loop = loop
+        self.writer = writer
+        self.timeout = timeout
+
+    async def _write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def write(self, text):
+        future = asyncio.run_coroutine_threadsafe(self._write(text.encode('utf-8')), self.loop)
+        try:
+            future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise EOFError('Session output stalled')
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class SessionCommand(Command):
+    def __init__(self, loop, reader, writer, source, idle_timeout):
+        stream = SessionStream(loop, writer, idle_timeout)
+        super().__init__(stdout=stream, stderr=stream)
+        self.loop = loop
+        self.reader = reader
+        self.source = source
+        self.idle_timeout = idle_timeout
+
+    def prompt(self, text):
+        self.stdout.write(text, ending='')
+        future = asyncio.run_coroutine_threadsafe(self.reader.readline(), self.loop)
+        try:
+            line = future.result(self.idle_timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise EOFError('Session timed out')
+        if not line:
+            raise EOFError('Session closed')
+        return line.decode('utf-8', errors='replace').rstrip('\r\n')
+
+
+class SessionServer:
+    """
+    Serves access_manager menu sessions over a TCP or Unix socket from one process, so
+    every session shares the same warm permission, detail and throttle caches. Socket
+    I/O runs on the event loop; the menu is blocking code, so each open session holds one
+    worker thread. Connections beyond `max_sessions` are told so and closed right away.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8765, socket_path=None, max_sessions=256, idle_timeout=900):
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.open_sessions = 0
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_sessions,
+                                                              thread_name_prefix='menu-session')
+
+    def run_session(self, command):
+        try:
+            command.execute_manager()
+        finally:
+            # Every session thread owns its DB connection
+            connection.close()
+
+    async def handle_session(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        peer = writer.get_extra_info('peername')
+        source = peer[0] if isinstance(peer, tuple) else 'unix'
+        if self.open_sessions >= self.max_sessions:
+            # Rejected instead of waiting unanswered for a free worker thread
+            logger.warning(f'Session from {source} rejected: {self.open_sessions} sessions open')
+            message = f'Server busy: all {self.max_sessions} sessions are in use. Try again later.\n'
+            writer.write(message.encode('utf-8'))
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+            return
+
+        self.open_sessions += 1
+        logger.info(f'Session opened from {source}')
+        try:
+            command = SessionCommand(loop, reader, writer, source, self.idle_timeout)
+            await loop.run_in_executor(self.executor, self.run_session, command)
+        except Exception as e:
+            logger.error(f'Session from {source} failed: {e}')
+        finally:
+            self.open_sessions -= 1
+            writer.close()
+            await writer.wait_closed()
+            logger.info(f'Session from {source} closed')
+
+    async def serve(self):
+        if self.socket_path:
+            server = await asyncio.start_unix_server(self.handle_session, path=self.socket_path)
+        else:
+            server = await asyncio.start_server(self.handle_session, self.host, self.port)
+        async with server:
+            addresses = ', '.join(str(sock.getsockname()) for sock in server.sockets)
+            logger.info(f'Serving menu sessions on {addresses}')
+            await server.serve_forever()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
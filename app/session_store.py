@@ -0,0 +1,119 @@
+import hashlib
+import hmac
+import secrets
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import transaction
+
+User = get_user_model()
+
+
+def _cache():
+    return caches[getattr(settings, 'SESSION_TOKEN_CACHE_ALIAS', 'default')]
+
+
+def _ttl():
+    return getattr(settings, 'SESSION_TOKEN_TTL', 3600)
+
+
+def _token_key(token):
+    # Only a digest is stored so a dump of the cache does not leak usable tokens
+    return f'session_token:{hashlib.sha256(token.encode("utf-8")).hexdigest()}'
+
+
+def _generation_key(user_id):
+    return f'session_generation:{user_id}'
+
+
+def _get_generation(user_id, create=False):
+    cache = _cache()
+    if create:
+        cache.add(_generation_key(user_id), time.time_ns(), None)
+    # A missing generation (e.g. evicted) fails safe: every token of that user stops resolving
+    return cache.get(_generation_key(user_id))
+
+
+def _credentials_key(username, password):
+    # An HMAC keyed with SECRET_KEY: without the key, nothing in the cache can be checked against a password
+    message = f'{username}:{password}'.encode('utf-8')
+    digest = hmac.new(settings.SECRET_KEY.encode('utf-8'), message, hashlib.sha256).hexdigest()
+    return f'basic_credentials:{digest}'
+
+
+def _session_record(user, ttl):
+    return {
+        'user_id': user.pk,
+        'username': user.username,
+        'role': user.role,
+        'is_superuser': user.is_superuser,
+        'generation': _get_generation(user.pk, create=True),
+        'expires_at': time.time() + ttl,
+    }
+
+
+def _session_user(record):
+    user = User(id=record['user_id'], username=record['username'], role=record['role'],
+                is_superuser=record['is_superuser'], is_active=True)
+    user._state.adding = False
+    return user
+
+
+def issue_session_token(user):
+    token = secrets.token_urlsafe(32)
+    record = _session_record(user, _ttl())
+    # Stored once the surrounding transaction (if any) commits, so a rolled back login leaves no live token
+    transaction.on_commit(lambda: _cache().set(_token_key(token), record, _ttl()))
+    return token
+
+
+def resolve_session_token(token):
+    """
+    Returns the (unsaved-state, DB free) User a token was issued for, or None when it is
+    unknown, expired or revoked. Tokens are renewed once half of their lifetime is used.
+    """
+    if not token:
+        return None
+    cache = _cache()
+    key = _token_key(token)
+    record = cache.get(key)
+    if record is None or record['generation'] != _get_generation(record['user_id']):
+        return None
+
+    ttl = _ttl()
+    if record['expires_at'] - time.time() < ttl / 2:
+        record['expires_at'] = time.time() + ttl
+        cache.set(key, record, ttl)
+
+    user = _session_user(record)
+    user.session_token = token
+    return user
+
+
+def remember_credentials(username, password, user):
+    # Verified Basic credentials, so repeated requests skip the user lookup and bcrypt
+    ttl = getattr(settings, 'BASIC_AUTH_CACHE_TTL', 300)
+    if ttl:
+        _cache().set(_credentials_key(username, password), _session_record(user, ttl), ttl)
+
+
+def resolve_credentials(username, password):
+    """The User remembered for these credentials, or None. Revoking a user's sessions forgets them too."""
+    record = _cache().get(_credentials_key(username, password))
+    if record is None or record['generation'] != _get_generation(record['user_id']):
+        return None
+    return _session_user(record)
+
+
+def forget_credentials(username, password):
+    _cache().delete(_credentials_key(username, password))
+
+
+def revoke_session_token(token):
+    _cache().delete(_token_key(token))
+
+
+def revoke_user_sessions(user_id):
+    _cache().set(_generation_key(user_id), time.time_ns(), None)
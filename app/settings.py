@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -78,29 +80,124 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.sqlite3',
-#         'NAME': BASE_DIR / 'db.sqlite3',
-#     }
-# }
-
-DATABASES = {
-    'default': {
+# Pick a profile with the DATABASE_PROFILE environment variable:
+# 'mysql' (default) - the MySQL server from the README, with persistent, health-checked connections
+# 'sqlite' - a local dev.sqlite3 (or SQLITE_PATH), tuned with SQLITE_PRAGMAS below; no server needed.
+#            Not the tracked db.sqlite3: switching a file to WAL mode rewrites its header
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'mysql')
+
+DATABASE_PROFILES = {
+    'sqlite': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'dev.sqlite3'),
+        'CONN_MAX_AGE': 60,
+        'OPTIONS': {
+            # Seconds the driver waits for a lock before raising "database is locked"
+            'timeout': 20,
+        },
+    },
+    'mysql': {
         'ENGINE': 'django.db.backends.mysql',
-        'NAME': 'user_management_db',
-        'USER': 'root',
-        'PASSWORD': '',
-        'HOST': '127.0.0.1',
-        'PORT': '3306',
+        'NAME': os.environ.get('MYSQL_DATABASE', 'user_management_db'),
+        'USER': os.environ.get('MYSQL_USER', 'root'),
+        'PASSWORD': os.environ.get('MYSQL_PASSWORD', ''),
+        'HOST': os.environ.get('MYSQL_HOST', '127.0.0.1'),
+        'PORT': os.environ.get('MYSQL_PORT', '3306'),
+        # Keep connections open across requests instead of reconnecting for each one
+        'CONN_MAX_AGE': 300,
+        'CONN_HEALTH_CHECKS': True,
         'OPTIONS': {
             'init_command': "SET sql_mode='STRICT_TRANS_TABLES'"
         }
-    }
+    },
+}
+
+if DATABASE_PROFILE not in DATABASE_PROFILES:
+    raise ImproperlyConfigured(f'Unknown DATABASE_PROFILE "{DATABASE_PROFILE}". '
+                               f'Choose from: {", ".join(DATABASE_PROFILES)}')
+
+DATABASES = {
+    'default': DATABASE_PROFILES[DATABASE_PROFILE],
+}
+
+# Applied to every new SQLite connection (see app.apps). WAL lets readers run alongside the
+# writer, NORMAL sync is durable in WAL mode except on power loss, and reads of a hot database
+# file are served from the memory map instead of read() calls. The lock wait is set once, by
+# OPTIONS['timeout'] of the profile, since a busy_timeout pragma would silently override it.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
 }
 
 AUTH_USER_MODEL = "app.User"
 
+# has_perm() checks go through the permission cache (see app.permission_cache)
+AUTHENTICATION_BACKENDS = ['app.permission_cache.CachedPermissionBackend']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Point 'permissions' at a shared backend (Redis, Memcached, database) when running
+# several worker processes so permission changes are seen by all of them at once.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'default',
+    },
+    'permissions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'permissions',
+    },
+    # Session tokens and remembered Basic credentials. LocMem is per process and evicts entries
+    # beyond MAX_ENTRIES, which ends live sessions: size it for the concurrent sessions, and use
+    # a shared backend (Redis, Memcached) when several processes serve the API.
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sessions',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
+PERMISSION_CACHE_ALIAS = 'permissions'
+
+PERMISSION_CACHE_TIMEOUT = 300  # seconds
+
+# Task/Note detail cache: per process LRU plus an optional shared tier (a CACHES alias).
+# Without a shared tier, invalidations (edits, shares, deletes) reach other processes through
+# per-object generations in DETAIL_CACHE_GENERATION_ALIAS, so point that alias at a shared
+# backend when several processes serve requests.
+# Bump DETAIL_CACHE_VERSION to drop every cached payload, e.g. when their shape changes.
+
+DETAIL_CACHE_MAX_ENTRIES = 10000
+
+DETAIL_CACHE_TTL = 60  # seconds
+
+DETAIL_CACHE_SHARED_ALIAS = None
+
+DETAIL_CACHE_GENERATION_ALIAS = 'default'
+
+DETAIL_CACHE_VERSION = 1
+
+DETAIL_CACHE_STATS_INTERVAL = 300  # seconds between stats log lines
+
+# Per-table change versions used to build ETags for the JSON API
+CHANGE_VERSION_CACHE_ALIAS = 'default'
+
+# Opaque session tokens issued on login. Lifetime slides forward while the token is used.
+SESSION_TOKEN_CACHE_ALIAS = 'sessions'
+
+SESSION_TOKEN_TTL = 3600  # seconds
+
+# Verified Basic credentials are remembered (as an HMAC digest) for this long, so API requests
+# with Basic auth skip bcrypt. 0 verifies every request.
+BASIC_AUTH_CACHE_TTL = 300  # seconds
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -119,34 +216,126 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# bcrypt work factor for new password hashes. Hashes stored with another value are
+# upgraded on the next successful login. Use `manage.py calibrate_bcrypt` to pick one.
+
+BCRYPT_ROUNDS = 12
+
+# Login throttling
+# Failed logins are counted per username and per source over a sliding window. Once a
+# limit is reached further attempts are rejected before any DB lookup or bcrypt work.
+
+LOGIN_THROTTLE_CACHE_ALIAS = 'default'
+
+LOGIN_THROTTLE_WINDOW = 300  # seconds
+
+LOGIN_THROTTLE_USERNAME_LIMIT = 5
+
+LOGIN_THROTTLE_SOURCE_LIMIT = 20
+
+
+# Logging
+# Records are queued by the logging thread and written by a background QueueListener, so file
+# I/O, JSON encoding and rotation stay off the request path. Both files are rotated and gzipped.
+# Raise LOG_DB_LEVEL to DEBUG to log every SQL statement (only emitted while DEBUG is True).
+os.makedirs(LOG_DIR, exist_ok=True)
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+
+LOG_DB_LEVEL = os.environ.get('LOG_DB_LEVEL', 'WARNING')
+
+LOG_MAX_BYTES = 10 * 1024 * 1024
+
+LOG_BACKUP_COUNT = 10
 
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
-    'formatters': {
-        'verbose': {
-            'format': '{levelname} {asctime} {module} {message}',
-            'style': '{',
-        },
-    },
     'handlers': {
-        'file': {
-            'level': 'DEBUG',
-            'class': 'logging.FileHandler',
-            'filename': os.path.join(LOG_DIR, 'user_actions.log'),  # Log file path
-            'formatter': 'verbose',
+        # The file handlers are built and owned by the queue handler (see app.log_utils)
+        'queue': {
+            '()': 'app.log_utils.QueueListenerHandler',
+            'targets': [
+                {
+                    'class': 'app.log_utils.CompressedRotatingFileHandler',
+                    'level': 'DEBUG',
+                    'filename': os.path.join(LOG_DIR, 'user_actions.log'),  # Log file path
+                    'maxBytes': LOG_MAX_BYTES,
+                    'backupCount': LOG_BACKUP_COUNT,
+                    'delay': True,
+                    'formatter': {'fmt': '{levelname} {asctime} {module} {message}', 'style': '{'},
+                },
+                {
+                    'class': 'app.log_utils.CompressedTimedRotatingFileHandler',
+                    'level': 'DEBUG',
+                    'filename': os.path.join(LOG_DIR, 'user_actions.jsonl'),
+                    'when': 'midnight',
+                    'backupCount': LOG_BACKUP_COUNT,
+                    'utc': True,
+                    'delay': True,
+                    'formatter': {'()': 'app.log_utils.JsonFormatter'},
+                },
+            ],
         },
     },
     'loggers': {
         'django': {
-            'handlers': ['file'],
-            'level': 'DEBUG',
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
             'propagate': True,
         },
+        'django.db.backends': {
+            'level': LOG_DB_LEVEL,
+        },
+        'app': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
     },
 }
 
 
+# `access_manager --fast-start` skips migration work while models.py, the migration files and the
+# database are unchanged since the fingerprint stored here
+SCHEMA_STATE_FILE = os.path.join(BASE_DIR, '.schema_state.json')
+
+
+# Audit log writer
+# UserActionLog rows are buffered and written in batches from a background thread.
+# Set AUDIT_LOG_ASYNC to False to write every row synchronously on the caller's path.
+
+AUDIT_LOG_ASYNC = True
+
+AUDIT_LOG_BATCH_SIZE = 100
+
+AUDIT_LOG_FLUSH_INTERVAL = 2.0  # seconds
+
+# Rows older than this are moved to compressed archives by `manage.py purge_action_logs`
+AUDIT_LOG_RETENTION_DAYS = 90
+
+AUDIT_LOG_ARCHIVE_DIR = os.path.join(BASE_DIR, 'archive')
+
+# Daily audit rollups (`manage.py audit_rollup`). Rows younger than the lag are left for the
+# next run because the async writer may still be committing rows with lower ids.
+AUDIT_ROLLUP_LAG = 30  # seconds
+
+AUDIT_ROLLUP_BATCH_SIZE = 50000
+
+# `manage.py audit_query` exports stop this far behind now: the async writer stamps rows when
+# they are logged but inserts them up to a flush later, so a resumed export would skip them.
+AUDIT_EXPORT_LAG = 30  # seconds
+
+
+# Per-operation metrics of the user_utils services. A background thread of every process writes
+# a snapshot to METRICS_DIR every METRICS_DUMP_INTERVAL seconds; `manage.py access_stats` adds them up.
+METRICS_ENABLED = True
+
+METRICS_DIR = os.path.join(LOG_DIR, 'metrics')
+
+METRICS_DUMP_INTERVAL = 30.0  # seconds
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
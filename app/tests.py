@@ -0,0 +1,371 @@
+import base64
+import copy
+import gc
+import io
+import json
+import logging
+import logging.config
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.cache import caches
+from django.core.exceptions import PermissionDenied
+from django.core.management import call_command
+from django.http import Http404
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from app.audit_rollup import refresh_audit_rollups, rollup_report
+from app.batch_runner import BatchRunner
+from app.constants import RoleChoices
+from app.detail_cache import DetailCache
+from app.management.commands.import_users import Command as ImportUsersCommand
+from app.models import Task, UserActionLog, UserActionRollup, UserPermissionExclusion
+from app.password_utils import verify_password
+from app.permission_cache import load_permissions
+from app.role_permissions import backfill_role_memberships, prune_role_covered_permissions
+from app.user_utils import add_user_permission, register_user, remove_user_permission, task_delete, task_detail, \
+    task_edit, task_list, task_share
+
+User = get_user_model()
+
+
+class LoggingPipelineTests(SimpleTestCase):
+    def setUp(self):
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.log_dir.cleanup)
+        self.addCleanup(logging.config.dictConfig, settings.LOGGING)
+
+    def configure(self):
+        config = copy.deepcopy(settings.LOGGING)
+        for target in config['handlers']['queue']['targets']:
+            target['filename'] = os.path.join(self.log_dir.name, os.path.basename(target['filename']))
+        logging.config.dictConfig(config)
+        # Handlers only referenced by the queue handler must survive collection
+        gc.collect()
+        return logging.getLogger('app').handlers[0]
+
+    def test_record_reaches_both_log_files(self):
+        handler = self.configure()
+        logging.getLogger('app.tests').info('Logged %s', 'once', extra={'user': 'alice'})
+        handler.close()
+
+        with open(os.path.join(self.log_dir.name, 'user_actions.log')) as log_file:
+            self.assertIn('Logged once', log_file.read())
+        with open(os.path.join(self.log_dir.name, 'user_actions.jsonl')) as log_file:
+            line = log_file.readline()
+        self.assertIn('"message": "Logged once"', line)
+        self.assertIn('"user": "alice"', line)
+
+
+class ConditionalRequestTests(TestCase):
+    password = 'Quiet-Lantern-83'
+
+    def setUp(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        # Session tokens are stored on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/register/', {'username': 'alice', 'password': self.password},
+                                        content_type='application/json')
+        self.token = response.json()['token']
+
+    def assert_cheap_not_modified(self, authorization):
+        response = self.client.get('/api/tasks/', HTTP_AUTHORIZATION=authorization)
+        self.assertEqual(response.status_code, 200)
+
+        with mock.patch('app.models.verify_password', wraps=verify_password) as verify, self.assertNumQueries(0):
+            response = self.client.get('/api/tasks/', HTTP_AUTHORIZATION=authorization,
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        verify.assert_not_called()
+
+    def test_not_modified_with_bearer_token(self):
+        self.assert_cheap_not_modified(f'Bearer {self.token}')
+
+    def test_not_modified_with_basic_credentials(self):
+        credentials = base64.b64encode(f'alice:{self.password}'.encode('utf-8')).decode('ascii')
+        self.assert_cheap_not_modified(f'Basic {credentials}')
+
+    def test_basic_logout_keeps_token_sessions(self):
+        credentials = base64.b64encode(f'alice:{self.password}'.encode('utf-8')).decode('ascii')
+        response = self.client.post('/api/auth/logout/', HTTP_AUTHORIZATION=f'Basic {credentials}')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get('/api/tasks/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(response.status_code, 200)
+
+
+class BatchRunnerTests(TestCase):
+    def run_script(self, *operations):
+        lines = [json.dumps(operation) for operation in operations]
+        with self.captureOnCommitCallbacks(execute=True):
+            return list(BatchRunner().run(lines))
+
+    def test_failed_register_does_not_authenticate_login(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            register_user('admin', 'Owner-Secret-71', True)
+
+        register, login, grant = self.run_script(
+            {'op': 'register', 'username': 'admin', 'password': 'Attacker-Pw-12'},
+            {'op': 'login', 'username': 'admin', 'password': 'Attacker-Pw-12'},
+            {'op': 'grant', 'resource': 'note', 'username': 'admin', 'access': 'view'},
+        )
+        self.assertFalse(register['ok'])
+        self.assertFalse(login['ok'])
+        self.assertFalse(grant['ok'])
+
+    def test_login_after_register_in_same_batch(self):
+        register, login = self.run_script(
+            {'op': 'register', 'username': 'bob', 'password': 'Bob-Secret-55'},
+            {'op': 'login', 'username': 'bob', 'password': 'Bob-Secret-55'},
+        )
+        self.assertTrue(register['ok'])
+        self.assertTrue(login['ok'])
+
+
+class ImportUsersParseTests(SimpleTestCase):
+    def setUp(self):
+        self.command = ImportUsersCommand()
+        self.command.seen_usernames = set()
+
+    def test_rows_that_are_not_objects_are_row_errors(self):
+        for row in [[], 'x', 3, None]:
+            with self.assertRaisesMessage(ValueError, 'Each line must be a JSON object'):
+                self.command.parse_row(row)
+
+    def test_non_string_fields_are_row_errors(self):
+        for row in [{'username': 5, 'password': 'Secret-123'}, {'username': 'alice', 'password': ['x']}]:
+            with self.assertRaisesMessage(ValueError, 'must be strings'):
+                self.command.parse_row(row)
+
+
+class FirstAdminTests(TestCase):
+    def register(self, username):
+        with self.captureOnCommitCallbacks(execute=True):
+            return register_user(username, 'Quiet-Lantern-83', False)
+
+    def test_first_user_becomes_admin(self):
+        self.assertTrue(self.register('alice').is_admin)
+        self.assertFalse(self.register('bob').is_admin)
+
+    def test_next_user_becomes_admin_after_last_admin_is_gone(self):
+        self.register('alice').delete()
+        bob = self.register('bob')
+        self.assertTrue(bob.is_admin)
+
+        User.objects.filter(pk=bob.pk).update(role=RoleChoices.USER)
+        self.assertTrue(self.register('carol').is_admin)
+
+
+class AuditRollupTests(TestCase):
+    def test_rerun_does_not_double_count(self):
+        UserActionLog.objects.bulk_create([UserActionLog(user=None, action='view', app='task', details='')] * 3)
+        refresh_audit_rollups(lag=0)
+        refresh_audit_rollups(lag=0)
+        UserActionLog.objects.create(user=None, action='view', app='task', details='')
+        refresh_audit_rollups(lag=0)
+
+        self.assertEqual([row['total'] for row in rollup_report(group_by=['action'])], [4])
+        self.assertEqual(UserActionRollup.objects.count(), 1)
+
+
+class AuditExportTests(TestCase):
+    def test_export_leaves_out_rows_inside_the_lag(self):
+        now = timezone.now()
+        old, recent = UserActionLog.objects.bulk_create([
+            UserActionLog(action='view', app='task', details='old', timestamp=now - timedelta(minutes=5)),
+            UserActionLog(action='view', app='task', details='recent', timestamp=now),
+        ])
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'audit.jsonl')
+            call_command('audit_query', output=output, lag=60, stderr=io.StringIO())
+            with open(output) as export:
+                self.assertEqual([json.loads(line)['id'] for line in export], [old.id])
+
+            call_command('audit_query', output=output, resume=True, lag=0, stderr=io.StringIO())
+            with open(output) as export:
+                self.assertEqual([json.loads(line)['id'] for line in export], [old.id, recent.id])
+
+
+class ResourceAccessTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # The first registration becomes the admin
+        cls.admin, cls.owner, cls.viewer, cls.editor, cls.stranger = [
+            register_user(username, 'Quiet-Lantern-83', False)
+            for username in ['admin', 'owner', 'viewer', 'editor', 'stranger']]
+        for username in ['owner', 'viewer', 'editor', 'stranger']:
+            for access in ['change', 'delete']:
+                add_user_permission('task', username, access)
+
+        cls.task = Task.objects.create(title='Owned', content='', owner=cls.owner)
+        cls.legacy = Task.objects.create(title='Legacy', content='', owner=None)
+        task_share(cls.owner, cls.task.pk, ['viewer'])
+        task_share(cls.owner, cls.task.pk, ['editor'], can_edit=True)
+
+    def setUp(self):
+        # Cache invalidations of setUpTestData run on commit, which never comes
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        patcher = mock.patch('app.detail_cache._detail_cache', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def commit(self, service, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return service(*args, **kwargs)
+
+    def listed(self, user):
+        return [task.pk for task in task_list(user)['value']]
+
+    def edit(self, user, task):
+        return self.commit(task_edit, user, {'task_id': task.pk, 'title': 'Edited', 'content': ''})
+
+    def test_list_shows_own_shared_and_ownerless_rows(self):
+        other = Task.objects.create(title='Other', content='', owner=self.stranger)
+        self.assertEqual(self.listed(self.owner), [self.task.pk, self.legacy.pk])
+        self.assertEqual(self.listed(self.viewer), [self.task.pk, self.legacy.pk])
+        self.assertEqual(self.listed(self.editor), [self.task.pk, self.legacy.pk])
+        self.assertEqual(self.listed(self.stranger), [self.legacy.pk, other.pk])
+        self.assertEqual(self.listed(self.admin), [self.task.pk, self.legacy.pk, other.pk])
+
+    def test_detail(self):
+        for user in [self.owner, self.viewer, self.editor, self.admin]:
+            self.assertEqual(task_detail(user, self.task.pk)['value']['title'], 'Owned')
+        with self.assertRaises(Http404):
+            task_detail(self.stranger, self.task.pk)
+        self.assertEqual(task_detail(self.stranger, self.legacy.pk)['value']['title'], 'Legacy')
+
+    def test_edit(self):
+        for user in [self.owner, self.editor, self.admin]:
+            self.edit(user, self.task)
+        with self.assertRaises(PermissionDenied):
+            self.edit(self.viewer, self.task)
+        with self.assertRaises(Http404):
+            self.edit(self.stranger, self.task)
+
+    def test_delete_is_owner_or_admin_only(self):
+        for user in [self.viewer, self.editor]:
+            with self.assertRaises(PermissionDenied):
+                self.commit(task_delete, user, self.task.pk)
+        with self.assertRaises(Http404):
+            self.commit(task_delete, self.stranger, self.task.pk)
+        self.commit(task_delete, self.owner, self.task.pk)
+        self.assertFalse(Task.objects.filter(pk=self.task.pk).exists())
+
+    def test_ownerless_rows_are_read_only_for_non_admins(self):
+        for user in [self.owner, self.editor, self.stranger]:
+            with self.assertRaises(PermissionDenied):
+                self.edit(user, self.legacy)
+            with self.assertRaises(PermissionDenied):
+                self.commit(task_delete, user, self.legacy.pk)
+        with self.assertRaises(ValueError):
+            self.commit(task_share, self.owner, self.legacy.pk, ['viewer'])
+        self.edit(self.admin, self.legacy)
+        self.commit(task_delete, self.admin, self.legacy.pk)
+
+    def test_only_the_owner_shares_and_revoked_shares_stop_working(self):
+        with self.assertRaises(PermissionDenied):
+            self.commit(task_share, self.editor, self.task.pk, ['stranger'])
+        task_detail(self.viewer, self.task.pk)
+
+        self.commit(task_share, self.owner, self.task.pk, ['viewer', 'editor'], revoke=True)
+        with self.assertRaises(Http404):
+            task_detail(self.viewer, self.task.pk)
+        with self.assertRaises(Http404):
+            self.edit(self.editor, self.task)
+        self.assertEqual(self.listed(self.viewer), [self.legacy.pk])
+
+
+class RolePermissionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # The first registration becomes the admin
+        register_user('admin', 'Quiet-Lantern-83', False)
+        cls.alice = register_user('alice', 'Quiet-Lantern-83', False)
+
+    def setUp(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+
+    def commit(self, service, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return service(*args, **kwargs)
+
+    def assert_permission(self, user, perm, expected):
+        # A fresh instance, since ModelBackend memoizes permissions on the user object, marked
+        # active the way a logged in session's user is
+        user = User.objects.get(pk=user.pk)
+        user.is_active = True
+        self.assertEqual(user.has_perm(perm), expected)
+        self.assertEqual(perm in load_permissions(user.pk), expected)
+
+    def test_role_group_grants_are_inherited(self):
+        self.assertTrue(self.alice.groups.filter(name=RoleChoices.USER).exists())
+        self.assert_permission(self.alice, 'app.view_task', True)
+        self.assert_permission(self.alice, 'app.change_task', False)
+
+    def test_grant_and_revoke_of_a_direct_permission(self):
+        self.commit(add_user_permission, 'task', 'alice', 'change')
+        self.assert_permission(self.alice, 'app.change_task', True)
+        self.commit(remove_user_permission, 'task', 'alice', 'change')
+        self.assert_permission(self.alice, 'app.change_task', False)
+        self.assertFalse(UserPermissionExclusion.objects.filter(user=self.alice).exists())
+
+    def test_revoking_an_inherited_permission_excludes_it_for_that_user_only(self):
+        bob = register_user('bob', 'Quiet-Lantern-83', False)
+        self.commit(remove_user_permission, 'task', 'alice', 'view')
+        self.assertTrue(UserPermissionExclusion.objects.filter(user=self.alice,
+                                                               permission__codename='view_task').exists())
+        self.assert_permission(self.alice, 'app.view_task', False)
+        self.assert_permission(bob, 'app.view_task', True)
+
+        self.commit(add_user_permission, 'task', 'alice', 'view')
+        self.assertFalse(UserPermissionExclusion.objects.filter(user=self.alice).exists())
+        self.assert_permission(self.alice, 'app.view_task', True)
+
+    def test_backfill_keeps_revoked_defaults_of_legacy_users_revoked(self):
+        # Users from before role groups: per-user rows, no membership. Carol had view_note revoked
+        carol, dave = User.objects.bulk_create([User(username='carol', role=RoleChoices.USER),
+                                                User(username='dave', role=RoleChoices.USER)])
+        carol.user_permissions.add(Permission.objects.get(codename='view_task'))
+
+        self.assertEqual(backfill_role_memberships(), 2)
+        self.assert_permission(carol, 'app.view_task', True)
+        self.assert_permission(carol, 'app.view_note', False)
+        self.assert_permission(dave, 'app.view_note', True)
+        self.assertEqual(backfill_role_memberships(), 0)
+
+    def test_prune_removes_only_rows_a_group_already_grants(self):
+        self.alice.user_permissions.add(*Permission.objects.filter(codename__in=['view_task', 'change_task']))
+        self.assertEqual(prune_role_covered_permissions(dry_run=True), 1)
+        self.assertEqual(prune_role_covered_permissions(), 1)
+        self.assertEqual(list(self.alice.user_permissions.values_list('codename', flat=True)), ['change_task'])
+        self.assert_permission(self.alice, 'app.view_task', True)
+        self.assert_permission(self.alice, 'app.change_task', True)
+
+
+class DetailCacheTests(SimpleTestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_invalidation_reaches_other_processes_without_a_shared_tier(self):
+        # Two processes: separate local LRUs, one generation cache
+        first, second = [DetailCache(generation_alias='default') for _ in range(2)]
+        loads = []
+
+        def loader():
+            loads.append(1)
+            return {'shares': {len(loads): False}}
+
+        self.assertEqual(first.get_or_load('task', 1, loader), {'shares': {1: False}})
+        self.assertEqual(first.get_or_load('task', 1, loader), {'shares': {1: False}})
+        second.invalidate('task', 1)
+        self.assertEqual(first.get_or_load('task', 1, loader), {'shares': {2: False}})
+        self.assertEqual(first.stats()['local_hits'], 1)
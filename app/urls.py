@@ -17,6 +17,16 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 
+from app import views
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/auth/register/', views.register_view, name='api-register'),
+    path('api/auth/login/', views.login_view, name='api-login'),
+    path('api/auth/logout/', views.logout_view, name='api-logout'),
+    path('api/permissions/', views.permission_view, name='api-permissions'),
+    path('api/<str:resource>s/', views.resource_list_view, name='api-resource-list'),
+    path('api/<str:resource>s/search/', views.resource_search_view, name='api-resource-search'),
+    path('api/<str:resource>s/<int:object_id>/', views.resource_detail_view, name='api-resource-detail'),
+    path('api/<str:resource>s/<int:object_id>/shares/', views.resource_share_view, name='api-resource-share'),
 ]
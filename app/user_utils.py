@@ -2,16 +2,41 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Permission
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import PermissionDenied
-from app.models import Task, Note, UserActionLog
+from app.models import Task, Note, TaskShare, NoteShare, UserActionLog, UserPermissionExclusion
+from app.audit_writer import get_audit_writer
+from app.login_throttle import LoginThrottled, is_login_throttled, record_login_failure, reset_login_failures
+from app.search import search_queryset
+from app.detail_cache import get_detail_cache
+from app.metrics import instrument
+from app.change_versions import bump_table_version
+from app.session_store import issue_session_token, remember_credentials, resolve_credentials, resolve_session_token, \
+    revoke_session_token, revoke_user_sessions, forget_credentials
+from django.http import Http404
+from app.permission_cache import get_cached_permissions, has_cached_perm, invalidate_user_permissions, \
+    get_permissions_by_codename, load_permissions
+from app.role_permissions import inherited_permission_pairs
 from django.utils import timezone
-from app.constants import RoleChoices
+from app.constants import RoleChoices, PermissionChangeModes, LIST_PAGE_SIZE, LIST_MAX_PAGE_SIZE, EXPORT_CHUNK_SIZE
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+import heapq
 import logging
-
-from app.settings import LOG_DIR
+from itertools import islice
+from operator import attrgetter
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
+BULK_CHUNK_SIZE = 500
+
+SHARE_MODELS = {Task: TaskShare, Note: NoteShare}
+
+
+def chunked(items, size=BULK_CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
 
 def log_user_action(user, action, error=False, **kwargs):
     app = kwargs.get('app', 'app')
@@ -20,9 +45,15 @@ def log_user_action(user, action, error=False, **kwargs):
         logger.error(log_text)
     else:
         logger.info(log_text)
-    details = kwargs.get('details', '')
-    details = details + ' ' + log_text
-    UserActionLog.objects.create(user=user, action=action, details=details)
+    # The row already records user, action, app and time, so only the details are stored
+    details = kwargs.get('details') or ''
+    entry = UserActionLog(user=user, action=action, app=app, details=details)
+    if error:
+        get_audit_writer().write(entry)
+    else:
+        # Successful actions are only recorded once the surrounding transaction (if any) commits,
+        # so batched work that is rolled back leaves no rows pointing at rows that never existed
+        transaction.on_commit(lambda: get_audit_writer().write(entry))
 
 
 def log_permission_change():
@@ -35,112 +66,239 @@ def log_permission_change():
             except Exception:
                 return ValueError(f"No user exists with uname: {uname}")
 
-            previous_perms = user.get_user_permissions()
-            updated_perms = set(func(*args, **kwargs).get_user_permissions())
+            # Effective permissions, so changes to inherited ones are logged as well
+            previous_perms = load_permissions(user.pk)
+            updated_perms = load_permissions(func(*args, **kwargs).pk)
             added_perms = updated_perms - previous_perms
             removed_perms = previous_perms - updated_perms
             for added_perm in added_perms:
                 action, app = added_perm.split('.')[-1].split('_')
-                log_user_action(user, action, app, details=f'Granted {added_perm} permission to {uname} by {guarantor}')
+                log_user_action(user, action, app=app, details=f'Granted {added_perm} permission to {uname} by {guarantor}')
             for removed_perm in removed_perms:
                 action, app = removed_perm.split('.')[-1].split('_')
-                log_user_action(user, action, app,
+                log_user_action(user, action, app=app,
                                 details=f'Revoked {removed_perm} permission to {uname} by {guarantor}')
 
-        return wrapper
+        return instrument(func.__name__)(wrapper)
 
     return decorator
 
 
 def log_signin_attempts(action):
     def decorator(func):
-        def log(uname, text, is_error):
-            user = User.objects.get(username=uname)
+        def log(uname, text, is_error, user=None):
+            if not isinstance(user, User):
+                user = User.objects.get(username=uname)
             log_user_action(user, action, error=is_error, details=text)
 
         def wrapper(*args, **kwargs):
             uname = kwargs.get('username') or args[0]
             try:
                 user = func(*args, **kwargs)
+            except LoginThrottled:
+                # Aggregated instead of one audit row (and user lookup) per rejected attempt
+                get_audit_writer().increment(f'{action}_throttled', 'auth', uname)
+                raise
             except User.DoesNotExist:
                 raise ValueError(f"Matching user does not exist for uname: {uname}")
             except Exception as e:
                 log(uname, str(e), True)
                 raise e
             login_success = True if user else False
-            log(uname, f'Logged in - {login_success}', False)
+            log(uname, f'Logged in - {login_success}', False, user=user)
             return user
 
-        return wrapper
+        return instrument(func.__name__)(wrapper)
 
     return decorator
 
 
-def grant_default_resource_permissions(user):
-    for resource in ['task', 'note']:
-        for access in ['view', 'add', 'change', 'delete']:
-            if access != 'view' and not user.is_admin:
-                continue
-            permission = Permission.objects.get(codename=f'{access}_{resource}')
-            user.user_permissions.add(permission)
-            logger.info(f'Permission granted to user "{user.username}" to view {resource} at {timezone.now()}')
-
-
 @log_permission_change()
 def add_user_permission(resource, uname, access, **kwargs):
     user = User.objects.get(username=uname)
-    permission = Permission.objects.get(codename=f'{access}_{resource}')
-    user.user_permissions.add(permission)
-    user.save()
+    permission = get_permissions_by_codename()[f'{access}_{resource}']
+    with transaction.atomic():
+        UserPermissionExclusion.objects.filter(user=user, permission=permission).delete()
+        user.user_permissions.add(permission)
+        user.save()
+        transaction.on_commit(lambda: invalidate_user_permissions(user.pk))
     return user
 
 
 @log_permission_change()
 def remove_user_permission(resource, uname, access, **kwargs):
     user = User.objects.get(username=uname)
-    permission = Permission.objects.get(codename=f'{access}_{resource}')
-    user.user_permissions.remove(permission)
-    user.save()
+    permission = get_permissions_by_codename()[f'{access}_{resource}']
+    with transaction.atomic():
+        user.user_permissions.remove(permission)
+        # Permissions inherited from a group are revoked for this user only
+        if inherited_permission_pairs([user.pk], [permission.pk]):
+            UserPermissionExclusion.objects.get_or_create(user=user, permission=permission)
+        user.save()
+        transaction.on_commit(lambda: invalidate_user_permissions(user.pk))
     return user
 
 
+def bulk_set_permissions(usernames, resource, accesses, mode, guarantor='system'):
+    if mode not in PermissionChangeModes.values:
+        raise ValueError(f'Invalid mode "{mode}". Choose from: {", ".join(PermissionChangeModes.values)}')
+    codenames = {f'{access}_{resource}' for access in accesses}
+    permissions = {perm.id: perm for perm in
+                   Permission.objects.filter(content_type__app_label='app', codename__in=codenames)}
+    missing_codenames = codenames - {perm.codename for perm in permissions.values()}
+    if missing_codenames:
+        raise ValueError(f'Unknown permissions: {", ".join(sorted(missing_codenames))}')
+
+    usernames = set(usernames)
+    users = {}
+    for chunk in chunked(usernames):
+        for user in User.objects.filter(username__in=chunk).only('id', 'username'):
+            users[user.id] = user
+
+    through = User.user_permissions.through
+    permission_ids = list(permissions)
+    with transaction.atomic():
+        direct, inherited, excluded = set(), set(), set()
+        for chunk in chunked(users):
+            direct.update(through.objects.filter(user_id__in=chunk, permission_id__in=permission_ids).values_list(
+                'user_id', 'permission_id'))
+            inherited.update(inherited_permission_pairs(chunk, permission_ids))
+            excluded.update(UserPermissionExclusion.objects.filter(
+                user_id__in=chunk, permission_id__in=permission_ids).values_list('user_id', 'permission_id'))
+        effective = (direct | inherited) - excluded
+
+        if mode == PermissionChangeModes.GRANT:
+            changes = {(user_id, perm_id) for user_id in users for perm_id in permissions} - effective
+            through.objects.bulk_create([through(user_id=user_id, permission_id=perm_id) for user_id, perm_id in
+                                         changes - direct], batch_size=BULK_CHUNK_SIZE, ignore_conflicts=True)
+            for chunk in chunked({user_id for user_id, _ in excluded}):
+                UserPermissionExclusion.objects.filter(user_id__in=chunk, permission_id__in=permission_ids).delete()
+            verb = 'Granted'
+        else:
+            changes = effective
+            for chunk in chunked({user_id for user_id, _ in direct}):
+                through.objects.filter(user_id__in=chunk, permission_id__in=permission_ids).delete()
+            # Inherited permissions are revoked for these users only
+            UserPermissionExclusion.objects.bulk_create(
+                [UserPermissionExclusion(user_id=user_id, permission_id=perm_id) for user_id, perm_id in
+                 inherited - excluded], batch_size=BULK_CHUNK_SIZE, ignore_conflicts=True)
+            verb = 'Revoked'
+
+        entries = []
+        for user_id, perm_id in changes:
+            user, codename = users[user_id], permissions[perm_id].codename
+            action, app = codename.split('_')
+            entries.append(UserActionLog(user=user, action=action, app=app,
+                                         details=f'{verb} app.{codename} permission to {user.username} by {guarantor}'))
+        changed_user_ids = {user_id for user_id, _ in changes}
+        transaction.on_commit(lambda: get_audit_writer().write_many(entries))
+        transaction.on_commit(lambda: invalidate_user_permissions(*changed_user_ids))
+
+    found_usernames = {user.username for user in users.values()}
+    logger.info(f'{verb} {len(changes)} "{resource}" permissions for {len(changed_user_ids)} users by {guarantor} '
+                f'at {timezone.now()}')
+    return {'changed': len(changes), 'users': len(changed_user_ids),
+            'missing_users': sorted(usernames - found_usernames)}
+
+
 @log_signin_attempts('register')
-def register_user(username, password, is_admin):
+def register_user(username, password, is_admin, password_hash=None):
     try:
         role = RoleChoices.ADMIN if is_admin else RoleChoices.USER
-        user = User.objects.create_user(username=username, password=password, role=role)
-        grant_default_resource_permissions(user)
-        if user.log_in(password):
-            logger.info(f'User "{username}" registered at {timezone.now()}')
-            return user
-        raise ValueError(f'Post Registration Log In failed. Please retry!')
+        user = User(username=username, role=role)
+        # Hash before opening the transaction so bcrypt doesn't hold the admin check lock;
+        # callers that run in a transaction of their own pass a hash made before opening it
+        if password_hash:
+            user.password = password_hash
+        else:
+            user.set_password(password)
+        # Permissions come from the group of the user's role, joined by User.save()
+        user.save()
+        # The password was hashed just above, so logging in needs no second bcrypt verification
+        user.is_active = True
+        user.session_token = issue_session_token(user)
+        logger.info(f'User "{username}" registered at {timezone.now()}')
+        return user
     except Exception as e:
         raise ValueError(f'Registration failed: {e}')
 
 
 @log_signin_attempts('login')
-def login_user(username, password):
-    user = User.objects.get(username=username)
-    if user.log_in(password):
+def login_user(username, password, source=None, password_check=None):
+    # `password_check` is a (stored hash, outcome) pair of a check the caller ran outside its
+    # transaction; it only counts while the user's stored hash is still that hash
+    if is_login_throttled(username, source):
+        raise LoginThrottled('Too many failed login attempts. Please try again later.')
+    try:
+        user = User.objects.get(username=username)
+    except User.DoesNotExist:
+        record_login_failure(username, source)
+        raise
+    verified = None
+    if password_check and password_check[0] == user.password:
+        verified = password_check[1]
+    if user.log_in(password, verified=verified):
+        reset_login_failures(username)
+        user.session_token = issue_session_token(user)
         logger.info(f'User "{username}" logged in at {timezone.now()}')
         return user
     else:
+        record_login_failure(username, source)
         raise ValueError('Login failed. Check your username and password.')
 
 
 @log_signin_attempts('logout')
-def logout_user(username):
-    user = User.objects.get(username=username)
+def logout_user(username, token=None, password=None):
+    if token:
+        user = resolve_session_token(token)
+        if not user or user.username != str(username):
+            raise ValueError('Logout failed! Invalid or expired session.')
+        revoke_session_token(token)
+    elif password is not None:
+        # Basic auth: only the remembered credentials of this client are forgotten, tokens stay valid
+        user = User.objects.get(username=username)
+        forget_credentials(username, password)
+    else:
+        # Without a token every session of the user is ended
+        user = User.objects.get(username=username)
+        revoke_user_sessions(user.pk)
     if not user.log_out():
         raise ValueError('Logout failed!')
 
 
+@instrument('verify_credentials')
+def verify_credentials(username, password, source=None):
+    """
+    Checks Basic credentials without opening a session or writing an audit row. Successful
+    checks are remembered for BASIC_AUTH_CACHE_TTL seconds (see remember_credentials).
+    """
+    user = resolve_credentials(username, password)
+    if user:
+        return user
+    if is_login_throttled(username, source):
+        raise LoginThrottled('Too many failed login attempts. Please try again later.')
+    user = User.objects.filter(username=username).first()
+    if user is None or not user.log_in(password):
+        record_login_failure(username, source)
+        raise ValueError('Invalid username or password.')
+    reset_login_failures(username)
+    remember_credentials(username, password, user)
+    return user
+
+
+def authenticate_token(token):
+    user = resolve_session_token(token)
+    if not user:
+        raise ValueError('Invalid or expired session. Please log in again.')
+    return user
+
+
 def resource_permission_required(resource_access):
     def decorator(func):
         def wrapper(*args, **kwargs):
             user = args[0]
             action, app = resource_access.split('.')[-1].split('_')
-            if not user.has_perm(resource_access):
+            if not has_cached_perm(user, resource_access):
                 # print(user.get_all_permissions(), resource_access)
                 text = 'Insufficient permission to perform the operation'
                 log_user_action(user, action, app=app, details=text, error=True)
@@ -151,130 +309,471 @@ def resource_permission_required(resource_access):
             log_user_action(user, action, app=app, details=text)
             return _value
 
-        return wrapper
+        return instrument(func.__name__)(wrapper)
 
     return decorator
 
 
 def get_user_permissions(user, resource):
     access_scopes = set()
-    for perm in user.get_all_permissions():
+    for perm in get_cached_permissions(user):
         access, res = perm.split('.')[-1].split('_')
         if res == resource:
             access_scopes.add(access)
     return list(access_scopes)
 
 
+def merge_by_pk(*rows):
+    # Merges pk ordered iterables into one, dropping rows seen in an earlier iterable
+    last_pk = None
+    for obj in heapq.merge(*rows, key=attrgetter('pk')):
+        if obj.pk != last_pk:
+            last_pk = obj.pk
+            yield obj
+
+
+def list_page(querysets, after=None, limit=LIST_PAGE_SIZE):
+    # Keyset pagination on the primary key: every page is one indexed range scan per queryset, however deep it
+    # is. Several querysets (see visible_branches) are paged separately and merged
+    limit = max(1, min(int(limit), LIST_MAX_PAGE_SIZE))
+    pages = []
+    for queryset in querysets:
+        queryset = queryset.only('id', 'title').order_by('pk')
+        if after:
+            queryset = queryset.filter(pk__gt=after)
+        pages.append(list(queryset[:limit + 1]))
+    rows = list(islice(merge_by_pk(*pages), limit + 1))
+    next_cursor = rows[limit - 1].pk if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def _iterate_queryset(queryset, chunk_size):
+    queryset = queryset.order_by('pk')
+    after = None
+    while True:
+        chunk = list(queryset.filter(pk__gt=after)[:chunk_size] if after else queryset[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        after = chunk[-1].pk
+
+
+def iterate_in_chunks(querysets, chunk_size=EXPORT_CHUNK_SIZE):
+    # Unlike QuerySet.iterator(), memory stays flat on MySQL too, which cannot stream result sets
+    return merge_by_pk(*[_iterate_queryset(queryset, chunk_size) for queryset in querysets])
+
+
+def _parse_ids(ids):
+    parsed = []
+    for object_id in ids:
+        try:
+            parsed.append(int(object_id))
+        except (TypeError, ValueError):
+            parsed.append(None)
+    return parsed
+
+
+def sees_everything(user):
+    return user.is_admin or user.is_superuser
+
+
+def _shared_with(model, user, can_edit=False):
+    shares = SHARE_MODELS[model].objects.filter(user_id=user.pk, **{model._meta.model_name: OuterRef('pk')})
+    if can_edit:
+        shares = shares.filter(can_edit=True)
+    return Exists(shares)
+
+
+def visible_objects(model, user):
+    # Own, shared and ownerless (created before ownership existed) objects; admins see everything.
+    # Meant for lookups by pk: list pages use visible_branches() instead
+    if sees_everything(user):
+        return model.objects.all()
+    return model.objects.filter(Q(owner_id=user.pk) | Q(owner__isnull=True) | _shared_with(model, user))
+
+
+def visible_branches(model, user):
+    """
+    Querysets that together hold visible_objects(). Ordered by pk, each is a range scan of its own
+    index: (owner, id) for own and for ownerless rows, (user, object) of the shares for shared rows.
+    The OR of visible_objects() would instead walk the primary key testing every row.
+    """
+    if sees_everything(user):
+        return [model.objects.all()]
+    return [model.objects.filter(owner_id=user.pk), model.objects.filter(owner__isnull=True),
+            model.objects.filter(shares__user_id=user.pk)]
+
+
+def editable_objects(model, user):
+    # Ownerless objects are read-only for everyone but admins
+    if sees_everything(user):
+        return model.objects.all()
+    return model.objects.filter(Q(owner_id=user.pk) | _shared_with(model, user, True))
+
+
+def deletable_objects(model, user):
+    # Shares never allow deleting
+    if sees_everything(user):
+        return model.objects.all()
+    return model.objects.filter(owner_id=user.pk)
+
+
+def missing_object_errors(model, user, ids):
+    # Objects the user can see but not change are forbidden; hidden ones look like they don't exist
+    visible = set(visible_objects(model, user).filter(pk__in=ids).values_list('pk', flat=True)) if ids else set()
+    return {object_id: 'Permission denied' if object_id in visible else 'Does not exist' for object_id in ids}
+
+
+def raise_missing_object(model, user, object_id, verb):
+    name = model._meta.model_name
+    if missing_object_errors(model, user, [object_id])[object_id] == 'Permission denied':
+        raise PermissionDenied(f'You don\'t have permission to {verb} this {name}.')
+    raise Http404(f'{name.capitalize()} with ID {object_id} does not exist')
+
+
+def bulk_create_objects(model, items, user):
+    results, objects = [], []
+    for index, data in enumerate(items):
+        if not data.get('title'):
+            results.append({'index': index, 'ok': False, 'error': 'Title is required'})
+            continue
+        obj = model(title=data['title'], content=data.get('content') or '', owner_id=user.pk)
+        objects.append(obj)
+        results.append({'index': index, 'ok': True, 'object': obj})
+    with transaction.atomic():
+        model.objects.bulk_create(objects, batch_size=BULK_CHUNK_SIZE)
+    for result in results:
+        if result['ok']:
+            # None on backends that can't return the ids of a multi-row INSERT (MySQL): the rows
+            # carry nothing unique to read them back by and concurrent inserts can interleave ids
+            result['id'] = result.pop('object').pk
+    return results
+
+
+def bulk_update_objects(model, items, id_key, user):
+    ids = _parse_ids(item.get(id_key) for item in items)
+    with transaction.atomic():
+        existing = set()
+        for chunk in chunked({object_id for object_id in ids if object_id is not None}):
+            existing.update(editable_objects(model, user).filter(pk__in=chunk).values_list('pk', flat=True))
+        errors = missing_object_errors(model, user, [object_id for object_id in set(ids) - existing
+                                                     if object_id is not None])
+
+        results, objects = [], []
+        for index, (object_id, data) in enumerate(zip(ids, items)):
+            if object_id not in existing:
+                results.append({'index': index, 'id': data.get(id_key), 'ok': False,
+                                'error': errors.get(object_id, 'Does not exist')})
+            elif not data.get('title'):
+                results.append({'index': index, 'id': object_id, 'ok': False, 'error': 'Title is required'})
+            else:
+                objects.append(model(pk=object_id, title=data['title'], content=data.get('content') or ''))
+                results.append({'index': index, 'id': object_id, 'ok': True})
+        model.objects.bulk_update(objects, ['title', 'content'], batch_size=BULK_CHUNK_SIZE)
+    return results
+
+
+def bulk_delete_objects(model, ids, user):
+    ids = list(ids)
+    parsed_ids = _parse_ids(ids)
+    with transaction.atomic():
+        existing = set()
+        for chunk in chunked({object_id for object_id in parsed_ids if object_id is not None}):
+            deletable = deletable_objects(model, user).filter(pk__in=chunk)
+            chunk_ids = list(deletable.values_list('pk', flat=True))
+            existing.update(chunk_ids)
+            model.objects.filter(pk__in=chunk_ids).delete()
+    errors = missing_object_errors(model, user, [object_id for object_id in set(parsed_ids) - existing
+                                                 if object_id is not None])
+
+    results = []
+    for index, (object_id, raw_id) in enumerate(zip(parsed_ids, ids)):
+        if object_id in existing:
+            results.append({'index': index, 'id': object_id, 'ok': True})
+        else:
+            results.append({'index': index, 'id': raw_id, 'ok': False,
+                            'error': errors.get(object_id, 'Does not exist')})
+    return results
+
+
+def share_object(user, model, object_id, usernames, can_edit=False, revoke=False):
+    name = model._meta.model_name
+    obj = visible_objects(model, user).filter(pk=parse_id(object_id)).only('id', 'owner_id').first()
+    if obj is None:
+        raise Http404(f'{name.capitalize()} with ID {object_id} does not exist')
+    if obj.owner_id is None:
+        raise ValueError(f'{name.capitalize()} {obj.pk} has no owner and is visible to everyone')
+    if obj.owner_id != user.pk and not sees_everything(user):
+        raise PermissionDenied(f'Only the owner can share this {name}.')
+
+    usernames = set(usernames)
+    users = dict(User.objects.filter(username__in=usernames).values_list('id', 'username'))
+    share_model = SHARE_MODELS[model]
+    shares = share_model.objects.filter(user_id__in=users, **{name: obj})
+    with transaction.atomic():
+        if revoke:
+            shares.delete()
+        else:
+            shared_user_ids = set(shares.values_list('user_id', flat=True))
+            shares.update(can_edit=can_edit)
+            share_model.objects.bulk_create([share_model(user_id=user_id, can_edit=can_edit, **{name: obj})
+                                             for user_id in set(users) - shared_user_ids])
+        record_changes(name, obj.pk)
+
+    verb = 'unshared from' if revoke else f'shared ({"edit" if can_edit else "view"}) with'
+    return {'value': {'users': sorted(users.values()), 'missing_users': sorted(usernames - set(users.values()))},
+            'log_text': f'{name.capitalize()} {obj.pk} {verb} {", ".join(sorted(users.values())) or "-"} '
+                        f'at {timezone.now()}'}
+
+
+def parse_id(object_id):
+    try:
+        return int(object_id)
+    except (TypeError, ValueError):
+        raise Http404(f'Invalid ID: {object_id}')
+
+
+def load_detail(model, object_id):
+    obj = get_object_or_404(model, pk=parse_id(object_id))
+    # The ACL is cached with the payload so cache hits are authorized without a query
+    shares = SHARE_MODELS[model].objects.filter(**{model._meta.model_name: obj})
+    shares = dict(shares.values_list('user_id', 'can_edit'))
+    return {'title': obj.title, 'content': obj.content, 'owner_id': obj.owner_id, 'shares': shares}
+
+
+def authorize_detail(user, model, object_id, detail):
+    if not (sees_everything(user) or detail['owner_id'] in [None, user.pk] or user.pk in detail['shares']):
+        raise Http404(f'{model._meta.model_name.capitalize()} with ID {object_id} does not exist')
+    return {'title': detail['title'], 'content': detail['content'], 'owner_id': detail['owner_id']}
+
+
+def record_changes(resource, *object_ids):
+    def on_commit():
+        get_detail_cache().invalidate(resource, *object_ids)
+        bump_table_version(resource)
+
+    # Deferred until commit so readers can't re-cache the old row from a still open transaction
+    transaction.on_commit(on_commit)
+
+
+def bulk_log_text(resource, verb, results):
+    succeeded = [result['id'] for result in results if result['ok']]
+    ids = ', '.join(str(object_id) for object_id in succeeded if object_id is not None) or '-'
+    return f'{len(succeeded)}/{len(results)} {resource}s {verb} (IDs: {ids}) at {timezone.now()}'
+
+
 @resource_permission_required('app.view_task')
-def task_list(_):
-    tasks = Task.objects.all()
-    return {'value': list(tasks) or [], 'log_text': f'Task list retrieved at {timezone.now()}'}
+def task_list(user, after=None, limit=LIST_PAGE_SIZE, stream=False):
+    if stream:
+        return {'value': iterate_in_chunks(visible_branches(Task, user)), 'next_cursor': None,
+                'log_text': f'Task list streamed at {timezone.now()}'}
+    tasks, next_cursor = list_page(visible_branches(Task, user), after, limit)
+    return {'value': tasks, 'next_cursor': next_cursor,
+            'log_text': f'Task list page after ID {after} retrieved at {timezone.now()}'}
 
 
 @resource_permission_required('app.view_task')
-def task_detail(_, task_id):
-    task = get_object_or_404(Task, pk=task_id)
-    return {'value': {'title': task.title, 'content': task.content}, 'log_text': f'Task detail retrieved for note ID '
-                                                                                 f'{task_id} at {timezone.now()}'}
+def task_detail(user, task_id):
+    detail = get_detail_cache().get_or_load('task', parse_id(task_id), lambda: load_detail(Task, task_id))
+    return {'value': authorize_detail(user, Task, task_id, detail),
+            'log_text': f'Task detail retrieved for task ID {task_id} at {timezone.now()}'}
 
 
 @resource_permission_required('app.add_task')
-def task_create(_, data):
+def task_create(user, data):
     title = data.get('title')
     content = data.get('content')
     if title:
-        task = Task(title=title, content=content)
+        task = Task(title=title, content=content, owner_id=user.pk)
         task.save()
+        record_changes('task')
         return {'value': '', 'log_text': f'Task created with title "{title}" at {timezone.now()}'}
 
 
 @resource_permission_required('app.change_task')
-def task_edit(_, data):
+def task_edit(user, data):
     task_id = data.get('task_id')
     title = data.get('title')
     content = data.get('content')
-    task = Task.objects.filter(pk=task_id).first()
+    task = editable_objects(Task, user).filter(pk=parse_id(task_id)).first()
     if not task:
-        return {'value': '', 'log_text': 'You don\'t have permission to edit this task.'}
+        raise_missing_object(Task, user, parse_id(task_id), 'edit')
 
     if title:
         task.title = title
         task.content = content
-        task.save()
+        task.save(update_fields=['title', 'content'])
+        record_changes('task', task.pk)
         return {'value': '', 'log_text': f'Task with ID {task_id} edited at {timezone.now()}'}
 
 
 @resource_permission_required('app.delete_task')
-def task_delete(_, task_id):
-    task = Task.objects.filter(pk=task_id).first()
+def task_delete(user, task_id):
+    task = deletable_objects(Task, user).filter(pk=parse_id(task_id)).first()
     if not task:
-        return {'value': '', 'log_text': 'You don\'t have permission to delete this task.'}
+        raise_missing_object(Task, user, parse_id(task_id), 'delete')
 
     task.delete()
+    record_changes('task', parse_id(task_id))
     return {'value': '', 'log_text': f'Task with ID {task_id} deleted at {timezone.now()}'}
 
 
+@resource_permission_required('app.view_task')
+def task_search(user, query, limit=LIST_PAGE_SIZE):
+    limit = max(1, min(int(limit), LIST_MAX_PAGE_SIZE))
+    tasks = list(search_queryset(visible_objects(Task, user).only('id', 'title'), query)[:limit])
+    return {'value': tasks, 'log_text': f'Task search for "{query}" returned {len(tasks)} results at {timezone.now()}'}
+
+
+@resource_permission_required('app.add_task')
+def task_bulk_create(user, items):
+    results = bulk_create_objects(Task, items, user)
+    record_changes('task')
+    return {'value': results, 'log_text': bulk_log_text('task', 'created', results)}
+
+
+@resource_permission_required('app.change_task')
+def task_bulk_edit(user, items):
+    results = bulk_update_objects(Task, items, 'task_id', user)
+    record_changes('task', *[result['id'] for result in results if result['ok']])
+    return {'value': results, 'log_text': bulk_log_text('task', 'edited', results)}
+
+
+@resource_permission_required('app.delete_task')
+def task_bulk_delete(user, task_ids):
+    results = bulk_delete_objects(Task, task_ids, user)
+    record_changes('task', *[result['id'] for result in results if result['ok']])
+    return {'value': results, 'log_text': bulk_log_text('task', 'deleted', results)}
+
+
+@resource_permission_required('app.change_task')
+def task_share(user, task_id, usernames, can_edit=False, revoke=False):
+    return share_object(user, Task, task_id, usernames, can_edit=can_edit, revoke=revoke)
+
+
 @resource_permission_required('app.view_note')
-def note_list(_):
-    notes = Note.objects.all() or []
-    return {'value': list(notes), 'log_text': f'Note list retrieved at {timezone.now()}'}
+def note_list(user, after=None, limit=LIST_PAGE_SIZE, stream=False):
+    if stream:
+        return {'value': iterate_in_chunks(visible_branches(Note, user)), 'next_cursor': None,
+                'log_text': f'Note list streamed at {timezone.now()}'}
+    notes, next_cursor = list_page(visible_branches(Note, user), after, limit)
+    return {'value': notes, 'next_cursor': next_cursor,
+            'log_text': f'Note list page after ID {after} retrieved at {timezone.now()}'}
 
 
 @resource_permission_required('app.view_note')
-def note_detail(_, note_id):
-    note = get_object_or_404(Note, pk=note_id)
-    return {'value': {'title': note.title, 'content': note.content}, 'log_text': f'Note detail retrieved for note ID '
-                                                                                 f'{note_id} at {timezone.now()}'}
+def note_detail(user, note_id):
+    detail = get_detail_cache().get_or_load('note', parse_id(note_id), lambda: load_detail(Note, note_id))
+    return {'value': authorize_detail(user, Note, note_id, detail),
+            'log_text': f'Note detail retrieved for note ID {note_id} at {timezone.now()}'}
 
 
 @resource_permission_required('app.add_note')
-def note_create(_, data):
+def note_create(user, data):
     title = data.get('title')
     content = data.get('content')
     if title:
-        note = Note(title=title, content=content)
+        note = Note(title=title, content=content, owner_id=user.pk)
         note.save()
+        record_changes('note')
         return {'value': '', 'log_text': f'Note created with title "{title}" at {timezone.now()}'}
 
 
 @resource_permission_required('app.change_note')
-def note_edit(_, data):
+def note_edit(user, data):
     note_id = data.get('note_id')
     title = data.get('title')
     content = data.get('content')
-    note = Note.objects.filter(pk=note_id).first()
+    note = editable_objects(Note, user).filter(pk=parse_id(note_id)).first()
     if not note:
-        return {'value': '', 'log_text': 'You don\'t have permission to edit this note.'}
+        raise_missing_object(Note, user, parse_id(note_id), 'edit')
 
     if title:
         note.title = title
         note.content = content
-        note.save()
+        note.save(update_fields=['title', 'content'])
+        record_changes('note', note.pk)
         return {'value': '', 'log_text': f'Note with ID {note_id} edited at {timezone.now()}'}
 
 
 @resource_permission_required('app.delete_note')
-def note_delete(_, note_id):
-    note = Note.objects.filter(pk=note_id).first()
+def note_delete(user, note_id):
+    note = deletable_objects(Note, user).filter(pk=parse_id(note_id)).first()
     if not note:
-        return {'value': '', 'log_text': 'You don\'t have permission to delete this note.'}
+        raise_missing_object(Note, user, parse_id(note_id), 'delete')
 
     note.delete()
+    record_changes('note', parse_id(note_id))
     return {'value': '', 'log_text': f'Note with ID {note_id} deleted at {timezone.now()}'}
 
 
+@resource_permission_required('app.view_note')
+def note_search(user, query, limit=LIST_PAGE_SIZE):
+    limit = max(1, min(int(limit), LIST_MAX_PAGE_SIZE))
+    notes = list(search_queryset(visible_objects(Note, user).only('id', 'title'), query)[:limit])
+    return {'value': notes, 'log_text': f'Note search for "{query}" returned {len(notes)} results at {timezone.now()}'}
+
+
+@resource_permission_required('app.add_note')
+def note_bulk_create(user, items):
+    results = bulk_create_objects(Note, items, user)
+    record_changes('note')
+    return {'value': results, 'log_text': bulk_log_text('note', 'created', results)}
+
+
+@resource_permission_required('app.change_note')
+def note_bulk_edit(user, items):
+    results = bulk_update_objects(Note, items, 'note_id', user)
+    record_changes('note', *[result['id'] for result in results if result['ok']])
+    return {'value': results, 'log_text': bulk_log_text('note', 'edited', results)}
+
+
+@resource_permission_required('app.delete_note')
+def note_bulk_delete(user, note_ids):
+    results = bulk_delete_objects(Note, note_ids, user)
+    record_changes('note', *[result['id'] for result in results if result['ok']])
+    return {'value': results, 'log_text': bulk_log_text('note', 'deleted', results)}
+
+
+@resource_permission_required('app.change_note')
+def note_share(user, note_id, usernames, can_edit=False, revoke=False):
+    return share_object(user, Note, note_id, usernames, can_edit=can_edit, revoke=revoke)
+
+
+RESOURCE_SERVICES = {
+    'task': {'list': task_list, 'detail': task_detail, 'create': task_bulk_create, 'edit': task_bulk_edit,
+             'delete': task_bulk_delete, 'search': task_search, 'share': task_share, 'id_key': 'task_id'},
+    'note': {'list': note_list, 'detail': note_detail, 'create': note_bulk_create, 'edit': note_bulk_edit,
+             'delete': note_bulk_delete, 'search': note_search, 'share': note_share, 'id_key': 'note_id'},
+}
+
+SEARCH_SERVICES = {'task': task_search, 'note': note_search}
+
+
+def search(user, resource, query, limit=LIST_PAGE_SIZE):
+    if resource not in SEARCH_SERVICES:
+        raise ValueError(f'Search is not available for "{resource}". Choose from: {", ".join(SEARCH_SERVICES)}')
+    return SEARCH_SERVICES[resource](user, query, limit=limit)
+
+
 def create_db():
+    if connection.vendor != 'mysql':
+        # SQLite creates the database file on first connect
+        return True
     import mysql.connector
+    db = connection.settings_dict
     try:
         mydb = mysql.connector.connect(
-            host="127.0.0.1",
-            user="root",
+            host=db['HOST'] or '127.0.0.1',
+            port=int(db['PORT'] or 3306),
+            user=db['USER'],
+            password=db['PASSWORD'],
         )
-        db_name = "user_management_db"
+        db_name = db['NAME']
 
         cursor = mydb.cursor()
-        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {db_name}")
-        open(f'{LOG_DIR}/user_actions.log', 'a+')
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{db_name}`")
+        mydb.close()
 
         return True
     except mysql.connector.Error as err:
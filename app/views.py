@@ -0,0 +1,239 @@
+import base64
+import json
+
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.http import Http404, HttpResponseNotModified, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from app.change_versions import get_table_version
+from app.constants import PERMISSION_ACCESSES, PERMISSION_RESOURCES
+from app.login_throttle import LoginThrottled
+from app.permission_cache import has_cached_perm
+from app.user_utils import login_user, logout_user, register_user, add_user_permission, remove_user_permission, \
+    authenticate_token, verify_credentials, RESOURCE_SERVICES
+
+
+class Unauthorized(Exception):
+    pass
+
+
+def api_view(methods):
+    def decorator(func):
+        @csrf_exempt
+        def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return JsonResponse({'error': f'Method {request.method} not allowed'}, status=405)
+            try:
+                return func(request, *args, **kwargs)
+            except Unauthorized as e:
+                response = JsonResponse({'error': str(e)}, status=401)
+                response['WWW-Authenticate'] = 'Bearer realm="api", Basic realm="api"'
+                return response
+            except LoginThrottled as e:
+                return JsonResponse({'error': str(e)}, status=429)
+            except PermissionDenied as e:
+                return JsonResponse({'error': str(e) or 'Permission denied'}, status=403)
+            except Http404 as e:
+                return JsonResponse({'error': str(e) or 'Not found'}, status=404)
+            except ValidationError as e:
+                return JsonResponse({'error': ' '.join(e.messages)}, status=400)
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+
+        return wrapper
+
+    return decorator
+
+
+def json_body(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        raise ValueError('Request body must be valid JSON')
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    return data
+
+
+def client_address(request):
+    return request.META.get('REMOTE_ADDR')
+
+
+def basic_credentials(request):
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme.lower() != 'basic' or not credentials:
+        raise Unauthorized('Authentication required')
+    try:
+        username, _, password = base64.b64decode(credentials).decode('utf-8').partition(':')
+    except ValueError:
+        raise Unauthorized('Malformed credentials')
+    return username, password
+
+
+def authenticate(request):
+    # Bearer session tokens (issued by the login endpoint) resolve without a DB query or bcrypt.
+    # Basic credentials are checked without opening a session and remembered for a short while,
+    # so repeated Basic requests (e.g. polling with If-None-Match) are just as cheap
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme.lower() == 'bearer' and credentials:
+        try:
+            return authenticate_token(credentials.strip())
+        except ValueError as e:
+            raise Unauthorized(str(e))
+    username, password = basic_credentials(request)
+    try:
+        return verify_credentials(username, password, source=client_address(request))
+    except LoginThrottled:
+        raise
+    except ValueError as e:
+        raise Unauthorized(str(e))
+
+
+def get_resource_services(resource):
+    if resource not in RESOURCE_SERVICES:
+        raise Http404(f'Unknown resource "{resource}"')
+    return RESOURCE_SERVICES[resource]
+
+
+def make_etag(*parts):
+    return '"{}"'.format('-'.join(str(part) for part in parts))
+
+
+def is_not_modified(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+
+def conditional_json(request, user, resource, etag_parts, build):
+    # The permission check runs first so a 304 never reveals anything a 403 would hide,
+    # but nothing is queried or serialized when the client's copy is still current.
+    # Visibility depends on ownership and shares, so tags are per user
+    if not has_cached_perm(user, f'app.view_{resource}'):
+        raise PermissionDenied('Insufficient permission to perform the operation')
+    etag = make_etag(resource, get_table_version(resource), user.pk, *etag_parts)
+    if is_not_modified(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse(build())
+    response['ETag'] = etag
+    return response
+
+
+@api_view(['POST'])
+def register_view(request):
+    data = json_body(request)
+    username, password = data.get('username'), data.get('password')
+    if not username or not password:
+        raise ValueError('Both username and password are required')
+    validate_password(password)
+    user = register_user(username, password, bool(data.get('is_admin')))
+    return JsonResponse({'username': user.username, 'role': user.role, 'token': user.session_token}, status=201)
+
+
+@api_view(['POST'])
+def login_view(request):
+    # The only endpoint that opens a session for Basic credentials
+    username, password = basic_credentials(request)
+    try:
+        user = login_user(username, password, source=client_address(request))
+    except LoginThrottled:
+        raise
+    except ValueError as e:
+        raise Unauthorized(str(e))
+    return JsonResponse({'username': user.username, 'role': user.role, 'token': user.session_token})
+
+
+@api_view(['POST'])
+def logout_view(request):
+    user = authenticate(request)
+    token = getattr(user, 'session_token', None)
+    if token:
+        logout_user(user.username, token=token)
+    else:
+        logout_user(user.username, password=basic_credentials(request)[1])
+    return JsonResponse({'username': user.username})
+
+
+@api_view(['GET', 'POST'])
+def resource_list_view(request, resource):
+    services = get_resource_services(resource)
+    user = authenticate(request)
+    if request.method == 'POST':
+        data = json_body(request)
+        items = data['items'] if isinstance(data.get('items'), list) else [data]
+        results = services['create'](user, items)['value']
+        return JsonResponse({'results': results}, status=201)
+
+    after, limit = request.GET.get('after'), request.GET.get('limit', 20)
+
+    def build():
+        result = services['list'](user, after=after, limit=limit)
+        return {'results': [{'id': obj.id, 'title': obj.title} for obj in result['value']],
+                'next_cursor': result['next_cursor']}
+
+    return conditional_json(request, user, resource, ['list', after, limit], build)
+
+
+@api_view(['GET', 'PUT', 'DELETE'])
+def resource_detail_view(request, resource, object_id):
+    services = get_resource_services(resource)
+    user = authenticate(request)
+    if request.method == 'PUT':
+        data = json_body(request)
+        result = services['edit'](user, [dict(data, **{services['id_key']: object_id})])['value'][0]
+    elif request.method == 'DELETE':
+        result = services['delete'](user, [object_id])['value'][0]
+    else:
+        return conditional_json(request, user, resource, ['detail', object_id],
+                                lambda: dict(services['detail'](user, object_id)['value'], id=object_id))
+
+    if not result['ok']:
+        if result['error'] == 'Does not exist':
+            raise Http404(f'{resource.capitalize()} with ID {object_id} does not exist')
+        if result['error'] == 'Permission denied':
+            raise PermissionDenied(f'You don\'t have permission to change this {resource}.')
+        raise ValueError(result['error'])
+    return JsonResponse(result)
+
+
+@api_view(['POST', 'DELETE'])
+def resource_share_view(request, resource, object_id):
+    services = get_resource_services(resource)
+    user = authenticate(request)
+    data = json_body(request)
+    usernames = data.get('usernames')
+    if not isinstance(usernames, list) or not usernames:
+        raise ValueError('Expected "usernames" as a non-empty list')
+    result = services['share'](user, object_id, usernames, can_edit=bool(data.get('can_edit')),
+                               revoke=request.method == 'DELETE')
+    return JsonResponse(dict(result['value'], id=object_id))
+
+
+@api_view(['GET'])
+def resource_search_view(request, resource):
+    services = get_resource_services(resource)
+    user = authenticate(request)
+    query, limit = request.GET.get('q', ''), request.GET.get('limit', 20)
+    results = services['search'](user, query, limit=limit)['value']
+    return JsonResponse({'results': [{'id': obj.id, 'title': obj.title, 'rank': obj.rank} for obj in results]})
+
+
+@api_view(['POST', 'DELETE'])
+def permission_view(request):
+    user = authenticate(request)
+    if not user.is_admin:
+        raise PermissionDenied('Only admins can change permissions')
+    data = json_body(request)
+    resource, username, access = data.get('resource'), data.get('username'), data.get('access')
+    if resource not in PERMISSION_RESOURCES or access not in PERMISSION_ACCESSES or not username:
+        raise ValueError(f'Expected "username", "resource" ({", ".join(PERMISSION_RESOURCES)}) and "access" '
+                         f'({", ".join(PERMISSION_ACCESSES)})')
+    change_permission = add_user_permission if request.method == 'POST' else remove_user_permission
+    error = change_permission(resource, username, access, guarantor=user.username)
+    if isinstance(error, ValueError):
+        raise Http404(str(error))
+    return JsonResponse({'username': username, 'resource': resource, 'access': access,
+                         'granted': request.method == 'POST'})
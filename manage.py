@@ -2,6 +2,10 @@
 """Django's command-line utility for administrative tasks."""
 import os
 import sys
+import time
+
+# Read by `access_manager --profile-startup`
+STARTED_AT = time.perf_counter()
 
 
 def main():